@@ -4,13 +4,33 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 SECRET_KEY = 'AAABBCC'
 
+# tmdnlcl_app.backends.sqlite3는 WAL, synchronous=NORMAL, BEGIN IMMEDIATE를 켜서 배치의 여러 스레드가 동시에 써도
+# "database is locked"가 나지 않게 한다. 쓰기가 많으면 tmdnlcl_batch --single-writer도 같이 쓴다.
+# CONN_MAX_AGE가 None이면 스레드마다 연결을 계속 쓴다.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'tmdnlcl_app.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': None,
+        'OPTIONS': {
+            'timeout': 20,
+            'pragmas': {'journal_mode': 'WAL', 'synchronous': 'NORMAL'},
+        },
     }
 }
 
+# PostgreSQL은 연결을 CONN_MAX_AGE초 동안 다시 쓰고, 배치는 작업마다 끊긴 연결을 확인해서 다시 연결한다.
+# DATABASES = {
+#     'default': {
+#         'ENGINE': 'django.db.backends.postgresql',
+#         'NAME': 'tmdnlcl',
+#         'USER': 'tmdnlcl',
+#         'PASSWORD': '',
+#         'HOST': 'localhost',
+#         'CONN_MAX_AGE': 600,
+#     }
+# }
+
 ALLOWED_HOSTS = ["*"]
 
 DEBUG = True
@@ -41,7 +41,6 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'bootstrap4',
     'solo',
-    'django_cleanup',
     'tmdnlcl_app',
 ]
 
@@ -82,6 +81,12 @@ WSGI_APPLICATION = 'tmdnlcl.wsgi.application'
 DATABASES = external_settings.DATABASES
 
 
+# django-solo
+# https://github.com/lazybird/django-solo#settings
+
+SOLO_CACHE = 'default'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
@@ -121,3 +126,32 @@ MEDIA_URL = '/media/'
 
 STATIC_ROOT = os.path.join(BASE_DIR, 'public/static')
 MEDIA_ROOT = os.path.join(BASE_DIR, 'public/media')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'structured': {
+            'format': 'time=%(asctime)s level=%(levelname)s thread=%(threadName)s logger=%(name)s msg="%(message)s"',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'structured',
+        },
+    },
+    'loggers': {
+        'tmdnlcl_app': {
+            'handlers': ['console'],
+            'level': getattr(external_settings, 'LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+# 미디어 파일 전송을 프론트 서버에 넘긴다.
+# 'nginx'면 X-Accel-Redirect로 MEDIA_ACCEL_PREFIX 아래 경로를, 'sendfile'이면 X-Sendfile로 파일 경로를 넘긴다.
+# None이면 Django가 직접 보낸다.
+MEDIA_ACCEL = getattr(external_settings, 'MEDIA_ACCEL', None)
+MEDIA_ACCEL_PREFIX = getattr(external_settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/')
@@ -26,8 +26,9 @@ urlpatterns = [
     path('post/', app_views.post, name='post'),
     path('login/', app_views.login, name='login'),
     path('logout/', app_views.logout, name='logout'),
+    path('webhooks/twitter', app_views.webhook, name='webhook'),
+    path(f"{settings.MEDIA_URL.strip('/')}/<path:name>", app_views.media, name='media'),
     path('admin/', admin.site.urls),
 ]
 
 urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
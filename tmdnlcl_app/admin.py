@@ -1,7 +1,7 @@
 from django.contrib import admin
 from solo.admin import SingletonModelAdmin
 
-from tmdnlcl_app.models import AppSetting, TwitterUser, Tweet, Attachment
+from tmdnlcl_app.models import AppSetting, TwitterUser, Tweet, Attachment, OutboxOperation
 
 
 @admin.register(AppSetting)
@@ -11,7 +11,7 @@ class AppSettingAdmin(SingletonModelAdmin):
 
 @admin.register(TwitterUser)
 class TwitterUserAdmin(admin.ModelAdmin):
-    list_display = ['id', 'rate_limit_remaining', 'rate_limit_reset', 'mode']
+    list_display = ['id', 'screen_name', 'rate_limit_remaining', 'rate_limit_reset', 'mode']
 
 
 class AttachmentInline(admin.StackedInline):
@@ -23,3 +23,14 @@ class AttachmentInline(admin.StackedInline):
 class TweetAdmin(admin.ModelAdmin):
     list_display = ['id', 'user', 'submitted_at', 'content']
     inlines = [AttachmentInline]
+    exclude = ['converted_content']
+
+    def save_model(self, request, obj, form, change):
+        obj.update_converted_content()
+        super().save_model(request, obj, form, change)
+
+
+@admin.register(OutboxOperation)
+class OutboxOperationAdmin(admin.ModelAdmin):
+    list_display = ['key', 'user', 'status', 'attempts', 'next_attempt_at', 'last_error']
+    list_filter = ['kind', 'status']
@@ -0,0 +1,256 @@
+import asyncio
+import logging
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import aiohttp
+import pendulum
+from oauthlib.oauth1 import Client as OAuth1Client
+from twython import TwythonError, TwythonAuthError, TwythonRateLimitError
+
+from tmdnlcl_app import metrics, ratelimit
+from tmdnlcl_app.db import recycle
+from tmdnlcl_app.models import AppSetting, TwitterUser, SEARCH_PAGE_SIZE, SEARCH_MAX_PAGES, SCREEN_NAME_TTL
+from tmdnlcl_app.batch import SEARCH_KEYWORD, SYNC_INTERVAL, sync_users
+
+API_URL = "https://api.twitter.com/1.1"
+REQUEST_TIMEOUT = 30
+
+logger = logging.getLogger(__name__)
+
+LIMIT_KEYS = {
+    'search/tweets.json': 'search',
+    'users/show.json': 'users/show',
+}
+
+
+class AsyncEngine:
+    def __init__(self, scheduler, leases, pipeline, threads, concurrency, connections, limiter=None):
+        self.scheduler = scheduler
+        self.leases = leases
+        self.pipeline = pipeline
+        self.threads = threads
+        self.concurrency = concurrency
+        self.connections = connections
+        self.name = "Async"
+        self.executor = None
+        self.dispatcher = None
+        self.session = None
+        self.limiter = limiter
+        self.slots = None
+        self.inflight = 0
+
+        metrics.gauge("inflight_polls", lambda: self.inflight)
+
+        if limiter is None:
+            metrics.gauge("poll_concurrency", lambda: self.concurrency)
+
+    async def db(self, func, *args, **kwargs):
+        def run():
+            recycle()
+            return func(*args, **kwargs)
+
+        return await asyncio.get_event_loop().run_in_executor(self.executor, run)
+
+    async def run(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="tmdnlcl-db")
+        self.dispatcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tmdnlcl-dispatch")
+        self.slots = asyncio.Semaphore(self.concurrency)
+
+        connector = aiohttp.TCPConnector(limit=self.connections, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+
+        tasks = set()
+
+        try:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+                self.session = session
+
+                syncer = asyncio.ensure_future(self.sync())
+
+                try:
+                    while True:
+                        user_id = await asyncio.get_event_loop().run_in_executor(self.dispatcher, self.scheduler.get, 1)
+
+                        if user_id is None:
+                            continue
+
+                        await self.acquire()
+                        self.inflight += 1
+
+                        task = asyncio.ensure_future(self.poll(user_id))
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+                finally:
+                    syncer.cancel()
+
+                    if tasks:
+                        logger.info("작업 종료 대기중...")
+                        await asyncio.wait(tasks)
+        finally:
+            self.dispatcher.shutdown(wait=False)
+            self.executor.shutdown()
+
+    async def acquire(self):
+        if self.limiter is None:
+            await self.slots.acquire()
+            return
+
+        # 한도나 회로가 풀릴 때까지 스레드에서 기다린다. 꺼내는 것은 한 번에 하나라서 디스패처 스레드로 충분하다.
+        while not await asyncio.get_event_loop().run_in_executor(self.dispatcher, self.limiter.acquire, 1):
+            pass
+
+    def release(self):
+        if self.limiter is None:
+            self.slots.release()
+        else:
+            self.limiter.release()
+
+    def measure(self, user):
+        if self.limiter is None:
+            return contextlib.suppress()
+
+        before = user.rate_limit_remaining
+        return self.limiter.measure(lambda: before != 0 and user.rate_limit_remaining == 0)
+
+    async def sync(self):
+        while True:
+            try:
+                await self.db(sync_users, self.scheduler, self.leases, self.pipeline)
+            except Exception:
+                logger.exception("사용자 동기화 실패")
+
+            await asyncio.sleep(SYNC_INTERVAL)
+
+    async def poll(self, user_id):
+        handed_off = False
+
+        try:
+            try:
+                user = await self.db(TwitterUser.objects.get, id=user_id)
+            except TwitterUser.DoesNotExist:
+                self.scheduler.remove(user_id)
+                handed_off = True
+                return
+
+            if not self.leases.owns(user):
+                self.scheduler.remove(user_id)
+                handed_off = True
+                return
+
+            try:
+                logger.debug("%s 탐색중", user.id)
+
+                with metrics.timed("search"), self.measure(user):
+                    raw_tweets = await self.search_tweets(user, SEARCH_KEYWORD)
+            except TwythonAuthError:
+                await self.db(self.pipeline.remove_user, self.name, user)
+                handed_off = True
+                return
+            except Exception:
+                logger.exception("%s 탐색 실패", user.id)
+                raw_tweets = []
+
+            # 다음 단계 큐가 가득 차 있으면 여기서 기다린다.
+            await self.db(self.pipeline.submit, user, raw_tweets)
+            handed_off = True
+        except Exception:
+            logger.exception("%s 탐색 작업 실패", user_id)
+        finally:
+            # 파이프라인에 넘기지 못했으면 스케줄러에 돌려놓아서 다음 주기에 다시 탐색한다.
+            if not handed_off:
+                self.scheduler.done(user_id, False)
+
+            self.inflight -= 1
+            self.release()
+
+    async def request(self, user, method, path, params):
+        key = f"{LIMIT_KEYS.get(path, path)}:{user.id}"
+
+        await self.db(ratelimit.acquire, key)
+
+        setting = await self.db(AppSetting.get_solo)
+
+        client = OAuth1Client(setting.twitter_api_key,
+                              client_secret=setting.twitter_api_secret,
+                              resource_owner_key=user.oauth_token,
+                              resource_owner_secret=user.oauth_token_secret)
+
+        uri, headers, _ = client.sign(f"{API_URL}/{path}?{urlencode(params)}", http_method=method)
+
+        async with self.session.request(method, uri, headers=headers) as response:
+            try:
+                content = await response.json(content_type=None)
+            except ValueError:
+                content = {}
+
+            if response.status >= 400:
+                message = f"Twitter API returned a {response.status}"
+
+                try:
+                    message += f" ({content['errors'][0]['message']})"
+                except (KeyError, IndexError, TypeError):
+                    pass
+
+                # Twython과 같이 401과 잘못된 인증 정보만 인증 실패로 본다. 403은 정지된 계정이나 정책 위반처럼 토큰과
+                # 상관없는 거절이라서, 인증 실패로 보면 사용자가 지워진다.
+                if response.status == 401 or 'Bad Authentication data' in message:
+                    raise TwythonAuthError(message, error_code=response.status)
+                elif response.status == 429:
+                    await self.db(ratelimit.exhaust, key, response.headers.get('X-Rate-Limit-Reset'))
+                    raise TwythonRateLimitError(message, error_code=response.status,
+                                                retry_after=response.headers.get('X-Rate-Limit-Reset'))
+                else:
+                    raise TwythonError(message, error_code=response.status)
+
+            await self.db(ratelimit.update, key,
+                          response.headers.get('X-Rate-Limit-Remaining'), response.headers.get('X-Rate-Limit-Reset'))
+
+            return content, response.headers
+
+    async def get_screen_name(self, user):
+        expired = user.screen_name_updated_at is None or \
+            user.screen_name_updated_at < pendulum.now().subtract(seconds=SCREEN_NAME_TTL)
+
+        if user.screen_name is None or expired:
+            content, _ = await self.request(user, 'GET', 'users/show.json', {'user_id': user.id})
+
+            await self.db(user.set_user_info, content)
+
+        return user.screen_name
+
+    async def search_tweets(self, user, keyword):
+        if user.rate_limit_remaining == 0 and pendulum.now() < user.rate_limit_reset:
+            return []
+
+        screen_name = await self.get_screen_name(user)
+
+        params = {'q': f"from:{screen_name} {keyword}", 'result_type': 'recent', 'count': SEARCH_PAGE_SIZE}
+
+        if user.last_tweet_id is not None:
+            params['since_id'] = user.last_tweet_id
+
+        tweets = []
+
+        try:
+            for _ in range(SEARCH_MAX_PAGES):
+                content, headers = await self.request(user, 'GET', 'search/tweets.json', params)
+                user.set_rate_limit(headers.get('X-Rate-Limit-Remaining'), headers.get('X-Rate-Limit-Reset'))
+
+                statuses = content['statuses']
+                tweets.extend(statuses)
+
+                if len(statuses) < SEARCH_PAGE_SIZE:
+                    break
+
+                params['max_id'] = min(status['id'] for status in statuses) - 1
+        except TwythonRateLimitError as e:
+            user.set_rate_limit(0, e.retry_after)
+            tweets = []
+        except ratelimit.RateLimited as e:
+            user.rate_limit_remaining = 0
+            user.rate_limit_reset = e.reset_at
+            tweets = []
+
+        return sorted({tweet['id']: tweet for tweet in tweets}.values(), key=lambda tweet: tweet['id'])
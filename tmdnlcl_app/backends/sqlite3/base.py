@@ -0,0 +1,36 @@
+from django.db.backends.sqlite3 import base
+
+DEFAULT_TIMEOUT = 20
+
+DEFAULT_PRAGMAS = {
+    # 읽는 쪽이 쓰는 쪽을 막지 않는다.
+    'journal_mode': 'WAL',
+    # WAL에서는 체크포인트 때만 fsync해도 DB가 깨지지 않는다. 전원이 나가면 마지막 커밋 몇 개만 잃는다.
+    'synchronous': 'NORMAL',
+}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # 배치의 여러 스레드가 같은 파일에 쓰는 경우를 위한 SQLite 설정.
+    # OPTIONS의 timeout은 잠금을 기다리는 시간(초), pragmas는 연결할 때마다 실행할 PRAGMA다.
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+
+        self.pragmas = {**DEFAULT_PRAGMAS, **kwargs.pop('pragmas', {})}
+
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        # BEGIN으로 시작하면 읽다가 쓰기로 넘어갈 때 다른 스레드가 쓰는 중이면 timeout을 기다리지 않고
+        # 바로 "database is locked"가 난다. 처음부터 쓰기 잠금을 잡아서 차례를 기다리게 한다.
+        self.cursor().execute("BEGIN IMMEDIATE")
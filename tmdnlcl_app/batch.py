@@ -0,0 +1,17 @@
+from tmdnlcl_app.stats import update_last_update
+from tmdnlcl_app import db, outbox
+
+SEARCH_KEYWORD = "#NintendoSwitch"
+SYNC_INTERVAL = 30
+
+
+def sync_users(scheduler, leases, pipeline):
+    db.recycle()
+
+    scheduler.sync(leases.rebalance())
+    update_last_update()
+
+    pipeline.sweep_thumbnails()
+
+    outbox.recover()
+    outbox.purge_done()
@@ -0,0 +1,222 @@
+import time
+import asyncio
+import logging
+import threading
+import contextlib
+import collections
+
+import requests
+from twython import TwythonError, TwythonAuthError, TwythonRateLimitError
+
+from tmdnlcl_app import metrics
+
+DECREASE_FACTOR = 0.7
+DECREASE_INTERVAL = 1
+LATENCY_TOLERANCE = 2.0
+LATENCY_FLOOR = 0.05
+SHORT_SMOOTHING = 0.2
+LONG_SMOOTHING = 0.01
+
+BREAKER_WINDOW = 20
+BREAKER_ERROR_RATE = 0.5
+BREAKER_COOLDOWN = 30
+BREAKER_MAX_COOLDOWN = 10 * 60
+
+logger = logging.getLogger(__name__)
+
+
+def is_upstream_error(error):
+    # 트위터 쪽이 느리거나 고장 났다는 신호만 센다. 인증 실패나 잘못된 요청은 사용자 문제라서 빼고, 429는 따로 센다.
+    if isinstance(error, (TwythonAuthError, TwythonRateLimitError)):
+        return False
+
+    if isinstance(error, TwythonError):
+        return error.error_code is None or error.error_code >= 500
+
+    return isinstance(error, (requests.RequestException, OSError, asyncio.TimeoutError))
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, window=BREAKER_WINDOW, error_rate=BREAKER_ERROR_RATE, cooldown=BREAKER_COOLDOWN,
+                 max_cooldown=BREAKER_MAX_COOLDOWN):
+        self.name = name
+        self.error_rate = error_rate
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.results = collections.deque(maxlen=window)
+        self.state = self.CLOSED
+        self.opened_until = 0
+        self.probe_started = None
+        self.lock = threading.Lock()
+
+        metrics.gauge("circuit_open", lambda: int(self.state != self.CLOSED), breaker=name)
+
+    def allow(self):
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+
+            now = time.monotonic()
+
+            if self.state == self.OPEN and now >= self.opened_until:
+                self.state = self.HALF_OPEN
+                self.probe_started = None
+
+            # 반쯤 열린 상태에서는 요청 하나만 보내 보고 결과에 따라 닫거나 다시 연다.
+            # 자리만 잡고 요청을 보내지 않은 경우도 있어서, 결과가 오래 안 오면 다른 요청으로 다시 확인한다.
+            if self.state == self.HALF_OPEN and \
+                    (self.probe_started is None or now - self.probe_started >= self.base_cooldown):
+                self.probe_started = now
+                return True
+
+            return False
+
+    def wait_time(self):
+        with self.lock:
+            if self.state == self.OPEN:
+                return max(self.opened_until - time.monotonic(), 0)
+
+            return 0
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_until = time.monotonic() + self.cooldown
+        self.results.clear()
+
+        metrics.inc("circuit_trips_total", breaker=self.name)
+        logger.warning("%s 회로 열림, %s초 동안 요청 중단", self.name, self.cooldown)
+
+    def record(self, ok):
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                if self.probe_started is None:
+                    return
+
+                self.probe_started = None
+
+                if ok:
+                    logger.info("%s 회로 닫힘", self.name)
+                    self.state = self.CLOSED
+                    self.cooldown = self.base_cooldown
+                else:
+                    self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+                    self._open()
+
+                return
+
+            # 열리기 전에 나간 요청의 결과는 무시한다.
+            if self.state == self.OPEN:
+                return
+
+            self.results.append(ok)
+
+            if len(self.results) == self.results.maxlen and \
+                    self.results.count(False) >= self.error_rate * len(self.results):
+                self._open()
+
+
+class AdaptiveLimiter:
+    # 동시에 나가는 요청 수를 AIMD로 조절한다. 잘 되면 한도를 한 번에 1씩 천천히 올리고, 에러, 429, 평소보다 긴
+    # 지연 시간이 보이면 곱으로 내린다. breaker가 열려 있는 동안에는 아무것도 내보내지 않는다.
+    def __init__(self, name, max_limit, min_limit=1, initial=None, breaker=None, latency_tolerance=LATENCY_TOLERANCE):
+        self.name = name
+        self.max_limit = max(max_limit, min_limit)
+        self.min_limit = min_limit
+        self.limit = float(initial if initial is not None else max(min_limit, self.max_limit // 2))
+        self.breaker = breaker
+        self.latency_tolerance = latency_tolerance
+        self.short_latency = None
+        self.long_latency = None
+        self.last_decrease = 0
+        self.inflight = 0
+        self.condition = threading.Condition()
+
+        metrics.gauge("concurrency_limit", lambda: int(self.limit), limiter=name)
+        metrics.gauge("concurrency_inflight", lambda: self.inflight, limiter=name)
+
+    def acquire(self, timeout=None):
+        deadline = time.monotonic() + timeout if timeout is not None else None
+
+        with self.condition:
+            while True:
+                if self.inflight < int(self.limit) and (self.breaker is None or self.breaker.allow()):
+                    self.inflight += 1
+                    return True
+
+                wait = self.breaker.wait_time() if self.breaker is not None else 0
+                wait = wait or 1
+
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+
+                    if remaining <= 0:
+                        return False
+
+                    wait = min(wait, remaining)
+
+                self.condition.wait(wait)
+
+    def release(self):
+        with self.condition:
+            self.inflight -= 1
+            self.condition.notify()
+
+    def record(self, latency, error=False, throttled=False):
+        if self.breaker is not None:
+            self.breaker.record(not error)
+
+        now = time.monotonic()
+
+        with self.condition:
+            if not error:
+                # 최근 지연 시간과 오래 본 평균을 비교해서, 최근 것이 눈에 띄게 길어지면 밀리고 있다고 본다.
+                if self.long_latency is None:
+                    self.short_latency = self.long_latency = latency
+                else:
+                    self.short_latency += (latency - self.short_latency) * SHORT_SMOOTHING
+                    self.long_latency += (latency - self.long_latency) * LONG_SMOOTHING
+
+            slow = self.latency_tolerance is not None and self.long_latency is not None and \
+                self.short_latency > max(self.long_latency * self.latency_tolerance, LATENCY_FLOOR)
+
+            if error or throttled or slow:
+                # 같은 혼잡으로 동시에 실패한 요청들 때문에 한도가 바닥까지 떨어지지 않게 한 번만 줄인다.
+                if now - self.last_decrease >= DECREASE_INTERVAL:
+                    self.limit = max(self.min_limit, self.limit * DECREASE_FACTOR)
+                    self.last_decrease = now
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+            self.condition.notify_all()
+
+    @contextlib.contextmanager
+    def measure(self, throttled=None):
+        # throttled: 끝난 뒤에 한도를 다 썼는지 알려주는 함수. 요청 안에서 429를 삼키는 경우에 쓴다.
+        started = time.monotonic()
+
+        try:
+            yield
+        except Exception as e:
+            self.record(time.monotonic() - started, error=is_upstream_error(e),
+                        throttled=isinstance(e, TwythonRateLimitError))
+            raise
+
+        self.record(time.monotonic() - started, throttled=throttled is not None and throttled())
+
+    @contextlib.contextmanager
+    def slot(self):
+        self.acquire()
+
+        try:
+            with self.measure():
+                yield
+        finally:
+            self.release()
+
+
+upstream = CircuitBreaker("twitter")
@@ -0,0 +1,129 @@
+import time
+import queue
+import logging
+import functools
+import threading
+from concurrent.futures import Future
+
+from django.db import connections, transaction
+
+from tmdnlcl_app import metrics
+
+HEALTH_CHECK_INTERVAL = 30
+WRITE_BATCH_SIZE = 50
+
+logger = logging.getLogger(__name__)
+
+_writer = None
+
+
+def recycle():
+    # 웹 요청이 끝날 때 장고가 하는 정리를 배치 스레드에서는 작업 하나마다 한다. CONN_MAX_AGE가 지났거나 에러가 난
+    # 연결은 닫고, 한동안 확인하지 않은 연결은 살아 있는지 보고 끊겼으면 닫아서 다음 쿼리가 새로 연결하게 한다.
+    now = time.monotonic()
+
+    for connection in connections.all():
+        connection.close_if_unusable_or_obsolete()
+
+        if connection.connection is None:
+            continue
+
+        if now - getattr(connection, 'health_checked_at', 0) >= HEALTH_CHECK_INTERVAL:
+            if not connection.is_usable():
+                logger.warning("%s DB 연결이 끊겨서 다시 연결함", connection.alias)
+                connection.close()
+
+            connection.health_checked_at = now
+
+
+def set_writer(writer):
+    global _writer
+    _writer = writer
+
+
+def write(func, *args, **kwargs):
+    # 쓰기 스레드가 있으면 거기서 실행하고 끝날 때까지 기다린다. 없으면 지금 스레드에서 바로 실행한다.
+    writer = _writer
+
+    if writer is None or threading.current_thread() is writer:
+        return func(*args, **kwargs)
+
+    return writer.submit(func, args, kwargs)
+
+
+def writes(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return write(func, *args, **kwargs)
+
+    return wrapper
+
+
+class Writer(threading.Thread):
+    # 여러 스레드의 쓰기를 연결 하나로 모아서 실행한다. 큐에 쌓인 것은 한 트랜잭션으로 묶어 커밋을 한 번만 하고,
+    # 하나가 실패해도 나머지는 저장되도록 각각 세이브포인트 안에서 실행한다.
+    def __init__(self, batch_size=WRITE_BATCH_SIZE):
+        super().__init__(name="Writer")
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.exit = threading.Event()
+
+        metrics.gauge("queue_depth", self.queue.qsize, stage="Writer")
+
+    def submit(self, func, args, kwargs):
+        future = Future()
+        self.queue.put((future, func, args, kwargs))
+
+        return future.result()
+
+    def run(self):
+        while not self.exit.is_set() or not self.queue.empty():
+            try:
+                batch = [self.queue.get(True, 1)]
+            except queue.Empty:
+                continue
+
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            self.execute(batch)
+
+        connections.close_all()
+        logger.info("끝")
+
+    def execute(self, batch):
+        results = []
+
+        try:
+            recycle()
+
+            with metrics.timed("db_write_batch"), transaction.atomic():
+                for future, func, args, kwargs in batch:
+                    try:
+                        with transaction.atomic():
+                            results.append((future, func(*args, **kwargs), None))
+                    except Exception as e:
+                        results.append((future, None, e))
+        except Exception as e:
+            logger.exception("쓰기 %s개 저장 실패", len(batch))
+
+            for future, *_ in batch:
+                future.set_exception(e)
+
+            return
+
+        metrics.inc("db_writes_total", len(batch))
+
+        # 커밋이 끝난 뒤에야 기다리는 스레드를 깨워서, 돌아간 쪽에서는 항상 저장된 것을 보게 한다.
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def stop(self):
+        self.exit.set()
+        self.join()
@@ -0,0 +1,360 @@
+import io
+import re
+import json
+import time
+import email
+import random
+import threading
+import collections
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit, urlunsplit, parse_qs
+
+from requests.adapters import HTTPAdapter
+from PIL import Image
+
+from tmdnlcl_app import media, twitter
+
+RATE_LIMIT = 180
+RATE_LIMIT_WINDOW = 15 * 60
+IMAGE_SIZE = (1200, 800)
+VIDEO_SIZE = 5 * 1024 * 1024
+KEYWORD = "#NintendoSwitch"
+
+TOKEN_PATTERN = re.compile(r'oauth_token="([^"]+)"')
+SCREEN_NAME_PATTERN = re.compile(r"from:(\w+)")
+DESTROY_PATTERN = re.compile(r"^/1\.1/statuses/destroy/(\d+)\.json$")
+ID_PATTERN = re.compile(r"\d{6,}(_\d+)?")
+
+
+class RedirectAdapter(HTTPAdapter):
+    # 트위터로 가는 요청을 가짜 서버로 돌린다. 원래 호스트는 헤더로 넘겨서 서버가 구분하게 한다.
+    def __init__(self, base_url, **kwargs):
+        super().__init__(pool_maxsize=64, **kwargs)
+        self.base = urlsplit(base_url)
+
+    def send(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        request.headers['X-Original-Host'] = parts.netloc
+        request.url = urlunsplit((self.base.scheme, self.base.netloc, parts.path, parts.query, ''))
+
+        return super().send(request, **kwargs)
+
+
+def user_token(user_id):
+    return f"token-{user_id}"
+
+
+def screen_name(user_id):
+    return f"user{user_id}"
+
+
+def multipart_fields(content_type, body):
+    # 업로드 요청의 multipart 본문을 이름별 바이트로 나눈다.
+    message = email.message_from_bytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+
+    if not message.is_multipart():
+        return {}
+
+    return {part.get_param('name', header='content-disposition'): part.get_payload(decode=True)
+            for part in message.get_payload()}
+
+
+def activity_event(status):
+    # 계정 활동 웹훅이 보내는 모양. tmdnlcl_webhook replay에 한 줄씩 넘길 수 있다.
+    return {'for_user_id': str(status['user']['id']), 'tweet_create_events': [status]}
+
+
+class FakeTwitter:
+    def __init__(self, latency=0.0, rate_limit=RATE_LIMIT, window=RATE_LIMIT_WINDOW, error_rate=0.0,
+                 image_size=IMAGE_SIZE, video_size=VIDEO_SIZE, seed=0):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.window = window
+        self.error_rate = error_rate
+        self.image_size = image_size
+        self.video_size = video_size
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.users = {}
+        self.screen_names = {}
+        self.statuses = {}
+        self.created = {}
+        self.repost_latencies = []
+        self.buckets = {}
+        self.requests = collections.Counter()
+        self.next_id = 10 ** 15
+        self.image = None
+        self.video = None
+        self.uploads = {}
+        self.server = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        handler = type('Handler', (_Handler,), {'fake': self})
+
+        self.server = _Server(('127.0.0.1', 0), handler)
+        threading.Thread(target=self.server.serve_forever, name="FakeTwitter", daemon=True).start()
+
+        return self.base_url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def install(self):
+        adapter = RedirectAdapter(self.base_url)
+
+        twitter.set_transport(adapter)
+        media.set_transport(adapter)
+
+    def _id(self):
+        self.next_id += 1
+        return self.next_id
+
+    def count(self, method, host, path):
+        with self.lock:
+            self.requests[f"{method} {host}{ID_PATTERN.sub('{id}', path)}"] += 1
+
+    def add_user(self, user_id):
+        with self.lock:
+            self.users[user_id] = collections.OrderedDict()
+            self.screen_names[screen_name(user_id)] = user_id
+
+    def add_tweet(self, user_id, photos=1, video=False):
+        with self.lock:
+            tweet_id = self._id()
+
+            if video:
+                media = [{
+                    'type': 'video',
+                    'url': f"https://t.co/{tweet_id}",
+                    'media_url': f"https://pbs.twimg.com/ext_tw_video_thumb/{tweet_id}/pu/img/thumb.jpg",
+                    'video_info': {'variants': [
+                        {'content_type': 'application/x-mpegURL',
+                         'url': f"https://video.twimg.com/ext_tw_video/{tweet_id}/pu/pl/playlist.m3u8"},
+                        {'content_type': 'video/mp4', 'bitrate': 832000,
+                         'url': f"https://video.twimg.com/ext_tw_video/{tweet_id}/pu/vid/video.mp4"},
+                    ]},
+                }]
+            else:
+                media = [{
+                    'type': 'photo',
+                    'url': f"https://t.co/{tweet_id}",
+                    'media_url': f"https://pbs.twimg.com/media/{tweet_id}_{i}.jpg",
+                } for i in range(photos)]
+
+            status = {
+                'id': tweet_id,
+                'text': f"&gt;dkssudgktpdy&lt; {tweet_id} {KEYWORD} https://t.co/{tweet_id}",
+                'user': {'id': user_id, 'screen_name': screen_name(user_id)},
+                'extended_entities': {'media': media},
+            }
+
+            self.users[user_id][tweet_id] = status
+            self.statuses[tweet_id] = status
+            self.created[tweet_id] = time.monotonic()
+
+            return status
+
+    def pending_reposts(self):
+        with self.lock:
+            return len(self.created)
+
+    def get_image(self):
+        with self.lock:
+            if self.image is None:
+                output = io.BytesIO()
+                Image.effect_noise(self.image_size, 64).convert('RGB').save(output, 'JPEG', quality=90)
+                self.image = output.getvalue()
+
+            return self.image
+
+    def get_video(self):
+        with self.lock:
+            if self.video is None:
+                self.video = bytes(self.random.getrandbits(8) for _ in range(1024)) * (self.video_size // 1024)
+
+            return self.video
+
+    def upload(self, command, params, fields):
+        # 조각 업로드(INIT/APPEND/FINALIZE/STATUS)를 흉내 낸다. 받은 바이트 수가 INIT 때 알린 크기와 다르면 실패한다.
+        with self.lock:
+            if command == 'INIT':
+                media_id = self._id()
+                self.uploads[media_id] = {'total': int(params['total_bytes']), 'segments': {}}
+                return 202, {'media_id': media_id, 'media_id_string': str(media_id)}
+
+            if command == 'UPLOAD':
+                media_id = self._id()
+                return 200, {'media_id': media_id, 'media_id_string': str(media_id)}
+
+            media_id = int(params.get('media_id') or fields.get('media_id', b'0'))
+            upload = self.uploads.get(media_id)
+
+            if upload is None:
+                return 400, {'errors': [{'code': 324, 'message': 'Invalid media id'}]}
+
+            if command == 'APPEND':
+                if 'media' not in fields:
+                    return 400, {'errors': [{'code': 38, 'message': 'media parameter is missing.'}]}
+
+                upload['segments'][int(fields['segment_index'])] = len(fields['media'])
+                return 204, b''
+
+            if command == 'FINALIZE' and sum(upload['segments'].values()) != upload['total']:
+                return 400, {'errors': [{'code': 324, 'message': 'File size mismatch'}]}
+
+            return 200, {'media_id': media_id, 'media_id_string': str(media_id),
+                         'processing_info': {'state': 'succeeded', 'progress_percent': 100}}
+
+    def limit(self, token, endpoint):
+        # (토큰, 엔드포인트)마다 창 단위로 호출 수를 센다. 429를 섞어야 하면 error_rate 비율로 돌려준다.
+        now = time.time()
+
+        with self.lock:
+            remaining, reset = self.buckets.get((token, endpoint), (self.rate_limit, now + self.window))
+
+            if reset <= now:
+                remaining, reset = self.rate_limit, now + self.window
+
+            limited = remaining <= 0 or self.random.random() < self.error_rate
+
+            if not limited:
+                remaining -= 1
+
+            self.buckets[(token, endpoint)] = (remaining, reset)
+
+        return limited, remaining, int(reset)
+
+    def search(self, params):
+        names = SCREEN_NAME_PATTERN.findall(params.get('q', ''))
+        since_id = int(params.get('since_id', 0))
+        max_id = int(params.get('max_id', 2 ** 63))
+        count = int(params.get('count', 15))
+
+        with self.lock:
+            statuses = [
+                status
+                for name in names if name in self.screen_names
+                for tweet_id, status in self.users[self.screen_names[name]].items()
+                if since_id < tweet_id <= max_id
+            ]
+
+        return {'statuses': sorted(statuses, key=lambda status: -status['id'])[:count]}
+
+    def repost(self, text):
+        now = time.monotonic()
+
+        with self.lock:
+            for token in text.split():
+                if token.isdigit() and int(token) in self.created:
+                    self.repost_latencies.append(now - self.created.pop(int(token)))
+                    break
+
+            return {'id': self._id(), 'text': text}
+
+    def destroy(self, tweet_id):
+        with self.lock:
+            status = self.statuses.pop(tweet_id, None)
+
+            if status is not None:
+                self.users[status['user']['id']].pop(tweet_id, None)
+
+        return {'id': tweet_id}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    fake = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body, content_type='application/json', headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+
+        self.end_headers()
+        self.wfile.write(body)
+
+    def token(self):
+        match = TOKEN_PATTERN.search(self.headers.get('Authorization', ''))
+        return match.group(1) if match else 'app'
+
+    def handle_request(self, method):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0) or 0))
+        parts = urlsplit(self.path)
+        host = self.headers.get('X-Original-Host', '')
+        params = {name: values[-1] for name, values in parse_qs(parts.query).items()}
+
+        if body and self.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+            params.update({name: values[-1] for name, values in parse_qs(body.decode()).items()})
+
+        if self.fake.latency:
+            time.sleep(self.fake.latency)
+
+        path = parts.path.split(':')[0]
+        self.fake.count(method, host, path)
+
+        if host.startswith('pbs.'):
+            return self.reply(200, self.fake.get_image(), 'image/jpeg')
+
+        if host.startswith('video.'):
+            return self.reply(200, self.fake.get_video(), 'video/mp4')
+
+        if path == '/oauth2/token':
+            return self.reply(200, {'token_type': 'bearer', 'access_token': 'app'})
+
+        if host.startswith('upload.'):
+            fields = multipart_fields(self.headers.get('Content-Type', ''), body) if body else {}
+            command = params.get('command') or fields.get('command', b'UPLOAD').decode()
+
+            return self.reply(*self.fake.upload(command, params, fields))
+
+        endpoint = path[len('/1.1/'):] if path.startswith('/1.1/') else path
+        limited, remaining, reset = self.fake.limit(self.token(), endpoint.split('/')[0])
+        headers = {'x-rate-limit-remaining': remaining, 'x-rate-limit-reset': reset}
+
+        if limited:
+            headers['x-rate-limit-remaining'] = 0
+            return self.reply(429, {'errors': [{'code': 88, 'message': 'Rate limit exceeded'}]}, headers=headers)
+
+        if endpoint == 'search/tweets.json':
+            return self.reply(200, self.fake.search(params), headers=headers)
+
+        if endpoint == 'users/show.json':
+            user_id = int(params['user_id'])
+            return self.reply(200, {'id': user_id, 'screen_name': screen_name(user_id), 'protected': False},
+                              headers=headers)
+
+        if endpoint == 'statuses/update.json':
+            return self.reply(200, self.fake.repost(params.get('status', '')), headers=headers)
+
+        match = DESTROY_PATTERN.match(path)
+
+        if match:
+            return self.reply(200, self.fake.destroy(int(match.group(1))), headers=headers)
+
+        return self.reply(404, {'errors': [{'code': 34, 'message': 'Sorry, that page does not exist'}]})
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
@@ -0,0 +1,113 @@
+from functools import lru_cache
+
+CACHE_SIZE = 4096
+
+KEY_TO_JAMO = {
+    'r': 'ㄱ', 'R': 'ㄲ', 's': 'ㄴ', 'e': 'ㄷ', 'E': 'ㄸ', 'f': 'ㄹ', 'a': 'ㅁ', 'q': 'ㅂ', 'Q': 'ㅃ', 't': 'ㅅ',
+    'T': 'ㅆ', 'd': 'ㅇ', 'w': 'ㅈ', 'W': 'ㅉ', 'c': 'ㅊ', 'z': 'ㅋ', 'x': 'ㅌ', 'v': 'ㅍ', 'g': 'ㅎ',
+
+    'k': 'ㅏ', 'o': 'ㅐ', 'i': 'ㅑ', 'O': 'ㅒ', 'j': 'ㅓ', 'p': 'ㅔ', 'u': 'ㅕ', 'P': 'ㅖ', 'h': 'ㅗ', 'y': 'ㅛ',
+    'n': 'ㅜ', 'b': 'ㅠ', 'm': 'ㅡ', 'l': 'ㅣ',
+}
+
+LEADS = 'ㄱㄲㄴㄷㄸㄹㅁㅂㅃㅅㅆㅇㅈㅉㅊㅋㅌㅍㅎ'
+MEDIALS = 'ㅏㅐㅑㅒㅓㅔㅕㅖㅗㅘㅙㅚㅛㅜㅝㅞㅟㅠㅡㅢㅣ'
+TAILS = ['', 'ㄱ', 'ㄲ', 'ㄳ', 'ㄴ', 'ㄵ', 'ㄶ', 'ㄷ', 'ㄹ', 'ㄺ', 'ㄻ', 'ㄼ', 'ㄽ', 'ㄾ', 'ㄿ', 'ㅀ', 'ㅁ', 'ㅂ', 'ㅄ',
+         'ㅅ', 'ㅆ', 'ㅇ', 'ㅈ', 'ㅊ', 'ㅋ', 'ㅌ', 'ㅍ', 'ㅎ']
+
+MEDIAL_COMPOSE = {
+    ('ㅗ', 'ㅏ'): 'ㅘ', ('ㅗ', 'ㅐ'): 'ㅙ', ('ㅗ', 'ㅣ'): 'ㅚ',
+    ('ㅜ', 'ㅓ'): 'ㅝ', ('ㅜ', 'ㅔ'): 'ㅞ', ('ㅜ', 'ㅣ'): 'ㅟ',
+    ('ㅡ', 'ㅣ'): 'ㅢ',
+}
+
+TAIL_COMPOSE = {
+    ('ㄱ', 'ㅅ'): 'ㄳ', ('ㄴ', 'ㅈ'): 'ㄵ', ('ㄴ', 'ㅎ'): 'ㄶ', ('ㄹ', 'ㄱ'): 'ㄺ', ('ㄹ', 'ㅁ'): 'ㄻ', ('ㄹ', 'ㅂ'): 'ㄼ',
+    ('ㄹ', 'ㅅ'): 'ㄽ', ('ㄹ', 'ㅌ'): 'ㄾ', ('ㄹ', 'ㅍ'): 'ㄿ', ('ㄹ', 'ㅎ'): 'ㅀ', ('ㅂ', 'ㅅ'): 'ㅄ',
+}
+
+TAIL_SPLIT = {tail: pair for pair, tail in TAIL_COMPOSE.items()}
+
+# 키 하나가 자음인지 모음인지, 조합에 쓸 인덱스는 무엇인지를 미리 계산해 둔다.
+CONSONANTS = {key: jamo for key, jamo in KEY_TO_JAMO.items() if jamo in LEADS}
+VOWELS = {key: jamo for key, jamo in KEY_TO_JAMO.items() if jamo in MEDIALS}
+
+LEAD_INDEX = {jamo: index * 21 * 28 for index, jamo in enumerate(LEADS)}
+MEDIAL_INDEX = {jamo: index * 28 for index, jamo in enumerate(MEDIALS)}
+TAIL_INDEX = {jamo: index for index, jamo in enumerate(TAILS) if jamo}
+
+
+def _compose(lead, medial, tail):
+    if lead is None:
+        return medial or ''
+
+    if medial is None:
+        return lead
+
+    return chr(0xAC00 + LEAD_INDEX[lead] + MEDIAL_INDEX[medial] + (TAIL_INDEX[tail] if tail else 0))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def e2h(text):
+    output = []
+    lead = medial = tail = None
+
+    for char in text:
+        consonant = CONSONANTS.get(char)
+
+        if consonant is not None:
+            if lead is not None and medial is not None:
+                if tail is None:
+                    if consonant in TAIL_INDEX:
+                        tail = consonant
+                        continue
+                else:
+                    compound = TAIL_COMPOSE.get((tail, consonant))
+
+                    if compound is not None:
+                        tail = compound
+                        continue
+
+            if lead is not None or medial is not None:
+                output.append(_compose(lead, medial, tail))
+
+            lead, medial, tail = consonant, None, None
+            continue
+
+        vowel = VOWELS.get(char)
+
+        if vowel is not None:
+            if tail is not None:
+                split = TAIL_SPLIT.get(tail)
+
+                if split is not None:
+                    output.append(_compose(lead, medial, split[0]))
+                    lead = split[1]
+                else:
+                    output.append(_compose(lead, medial, None))
+                    lead = tail
+
+                medial, tail = vowel, None
+            elif medial is not None:
+                compound = MEDIAL_COMPOSE.get((medial, vowel))
+
+                if compound is not None:
+                    medial = compound
+                else:
+                    output.append(_compose(lead, medial, None))
+                    lead, medial = None, vowel
+            else:
+                medial = vowel
+
+            continue
+
+        if lead is not None or medial is not None:
+            output.append(_compose(lead, medial, tail))
+            lead = medial = tail = None
+
+        output.append(char)
+
+    if lead is not None or medial is not None:
+        output.append(_compose(lead, medial, tail))
+
+    return ''.join(output)
@@ -0,0 +1,68 @@
+import os
+import socket
+import uuid
+
+import pendulum
+from django.db import transaction
+from django.db.models import Q
+
+from tmdnlcl_app.models import BatchNode, TwitterUser
+
+LEASE_TTL = 90
+NODE_TTL = 90
+
+
+class LeaseManager:
+    def __init__(self, name=None, lease_ttl=LEASE_TTL, node_ttl=NODE_TTL):
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lease_ttl = lease_ttl
+        self.node_ttl = node_ttl
+
+    def owns(self, user):
+        return user.lease_owner == self.name
+
+    def heartbeat(self):
+        now = pendulum.now()
+
+        BatchNode.objects.update_or_create(name=self.name, defaults={'heartbeat_at': now})
+        BatchNode.objects.filter(heartbeat_at__lt=now.subtract(seconds=self.node_ttl)).delete()
+
+        return BatchNode.objects.count()
+
+    def rebalance(self):
+        nodes = self.heartbeat()
+
+        now = pendulum.now()
+        expires_at = now.add(seconds=self.lease_ttl)
+        claimable = Q(lease_owner__isnull=True) | Q(lease_expires_at__lt=now)
+
+        share = -(-TwitterUser.objects.count() // nodes)
+
+        owned = TwitterUser.objects.filter(lease_owner=self.name)
+        owned.update(lease_expires_at=expires_at)
+        owned_ids = list(owned.order_by('id').values_list('id', flat=True))
+
+        if len(owned_ids) > share:
+            # 새로 들어온 프로세스가 가져갈 수 있도록 몫보다 많이 가진 만큼 내려놓는다.
+            TwitterUser.objects.filter(id__in=owned_ids[share:], lease_owner=self.name) \
+                .update(lease_owner=None, lease_expires_at=None)
+        elif len(owned_ids) < share:
+            with transaction.atomic():
+                candidates = list(
+                    TwitterUser.objects.select_for_update(skip_locked=True)
+                    .filter(claimable)
+                    .order_by('last_update')
+                    .values_list('id', flat=True)[:share - len(owned_ids)]
+                )
+
+                # FOR UPDATE를 지원하지 않는 SQLite에서도 조건부 UPDATE라서 두 프로세스가 같은 사용자를 가져가지 않는다.
+                TwitterUser.objects.filter(claimable, id__in=candidates) \
+                    .update(lease_owner=self.name, lease_expires_at=expires_at)
+
+        return list(TwitterUser.objects.filter(lease_owner=self.name).values_list(
+            'id', 'last_update', 'rate_limit_remaining', 'rate_limit_reset'
+        ))
+
+    def release(self):
+        TwitterUser.objects.filter(lease_owner=self.name).update(lease_owner=None, lease_expires_at=None)
+        BatchNode.objects.filter(name=self.name).delete()
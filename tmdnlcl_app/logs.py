@@ -0,0 +1,33 @@
+import queue
+import logging
+import logging.handlers
+
+LOGGER_NAME = 'tmdnlcl_app'
+
+_listener = None
+
+
+def start():
+    # 여러 스레드가 stdout을 두고 기다리지 않도록 로그는 큐에 넣기만 하고, 출력은 리스너 스레드가 맡는다.
+    global _listener
+
+    if _listener is not None:
+        return
+
+    logger = logging.getLogger(LOGGER_NAME)
+    records = queue.Queue()
+
+    _listener = logging.handlers.QueueListener(records, *logger.handlers, respect_handler_level=True)
+    logger.handlers = [logging.handlers.QueueHandler(records)]
+
+    _listener.start()
+
+
+def stop():
+    global _listener
+
+    if _listener is None:
+        return
+
+    _listener.stop()
+    _listener = None
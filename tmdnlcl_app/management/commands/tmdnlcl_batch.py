@@ -1,83 +1,146 @@
 import time
+import asyncio
+import contextlib
+import logging
 import threading
-import queue
 import collections
-import traceback
-import pendulum
 
 from django.core.management.base import BaseCommand
+from django.db import connections
 
-from tmdnlcl_app.models import Tweet, TwitterUser, AppSetting
+from tmdnlcl_app import concurrency, db, logs, metrics, ratelimit
+from tmdnlcl_app.models import TwitterUser, AppSetting
+from tmdnlcl_app.scheduler import Scheduler, MAX_BACKOFF
+from tmdnlcl_app.leases import LeaseManager, LEASE_TTL
+from tmdnlcl_app.pipeline import Pipeline, QUEUE_SIZE
+from tmdnlcl_app.batch import SEARCH_KEYWORD, SYNC_INTERVAL, sync_users
 
 from twython import TwythonAuthError
 
 
 Media = collections.namedtuple('Media', 'type,url')
 
+logger = logging.getLogger(__name__)
+
 
 class Worker(threading.Thread):
-    def __init__(self, name, q, delay):
+    def __init__(self, name, scheduler, leases, pipeline, batch_size=1, limiter=None):
         super().__init__()
         self.name = name
-        self.queue = q
+        self.scheduler = scheduler
+        self.leases = leases
+        self.pipeline = pipeline
+        self.batch_size = batch_size
+        self.limiter = limiter
+        self.busy = False
         self.exit = threading.Event()
-        self.delay = delay
 
     def run(self):
         while not self.exit.is_set():
-            try:
-                user_id = self.queue.get(True, 1)
-                user = TwitterUser.objects.get(id=user_id)
-            except queue.Empty:
-                continue
-            except TwitterUser.DoesNotExist:
-                self.queue.task_done()
+            # 한도보다 많은 워커는 여기서 기다린다. 회로가 열려 있으면 모든 워커가 멈춘다.
+            if self.limiter is not None and not self.limiter.acquire(timeout=1):
                 continue
 
-            first_tweet_id = None
-
             try:
-                print(f"[{self.name}] {user.id} 탐색중")
-
-                for raw_tweet in user.search_tweets("#NintendoSwitch"):
-                    if first_tweet_id is None:
-                        first_tweet_id = raw_tweet['id']
-
-                    tweet = Tweet.from_raw_tweet(user, raw_tweet)
-
-                    if tweet is not None:
-                        print(f"[{self.name}] {user.id} 트윗 발견")
-
-                    if tweet is not None:
-                        if user.mode == TwitterUser.MODE_INSTANT:
-                            print(f"[{self.name}] {user.id}-{tweet.id} 처리중")
-
-                            tweet.post()
-                            tweet.destroy()
-                            tweet.delete()
-                        else:
-                            print(f"[{self.name}] {user.id}-{tweet.id} 트윗 저장함")
-                            tweet.destroy()
-
-                if first_tweet_id is not None:
-                    user.last_tweet_id = first_tweet_id
-                    user.save(update_fields=['last_tweet_id'])
-            except TwythonAuthError:
-                print(f"[{self.name}] {user.id} 사용자 삭제됨.")
-                user.delete()
+                self.work()
             except Exception:
-                traceback.print_exc()
+                logger.exception("탐색 작업 실패")
+            finally:
+                if self.limiter is not None:
+                    self.limiter.release()
+
+        connections.close_all()
+        logger.info("끝")
+
+    def measure(self, user=None):
+        if self.limiter is None:
+            return contextlib.suppress()
+
+        if user is None:
+            return self.limiter.measure()
+
+        # 한도를 다 써서 검색이 빈 결과로 끝났으면 429를 맞은 것과 같이 본다.
+        before = user.rate_limit_remaining
+        return self.limiter.measure(lambda: before != 0 and user.rate_limit_remaining == 0)
+
+    def work(self):
+        user_ids = self.scheduler.get_many(self.batch_size, timeout=1)
+
+        if not user_ids:
+            return
+
+        self.busy = True
+
+        # 파이프라인에 넘기지 못한 사용자는 실패해도 스케줄러에 돌려놓아야 다음 주기에 다시 탐색한다.
+        pending = set(user_ids)
+
+        try:
+            db.recycle()
+
+            users = {user.id: user for user in TwitterUser.objects.filter(id__in=user_ids)}
+
+            for user_id in user_ids:
+                if user_id not in users or not self.leases.owns(users[user_id]):
+                    users.pop(user_id, None)
+                    self.scheduler.remove(user_id)
+                    pending.discard(user_id)
+
+            results = {}
+
+            if len(users) > 1:
+                try:
+                    logger.info("%s명 묶어서 탐색중", len(users))
+
+                    with metrics.timed("search_batch"), self.measure():
+                        results = TwitterUser.search_tweets_many(users.values(), SEARCH_KEYWORD)
+                except Exception:
+                    logger.exception("묶음 탐색 실패")
+
+            for user in users.values():
+                self.poll(user, results.get(user.id))
+                pending.discard(user.id)
+        finally:
+            for user_id in pending:
+                self.scheduler.done(user_id, False)
+
+            self.busy = False
 
-            self.queue.task_done()
+    def poll(self, user, raw_tweets=None):
+        try:
+            if raw_tweets is None:
+                logger.debug("%s 탐색중", user.id)
 
-            time.sleep(self.delay)
+                with metrics.timed("search"), self.measure(user):
+                    raw_tweets = user.search_tweets(SEARCH_KEYWORD)
+        except TwythonAuthError:
+            self.pipeline.remove_user(self.name, user)
+            return
+        except Exception:
+            logger.exception("%s 탐색 실패", user.id)
+            raw_tweets = []
 
-        print(f"[{self.name}] 끝")
+        self.pipeline.submit(user, raw_tweets)
 
 
 class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('threads', default=1, type=int)
+        parser.add_argument('--max-backoff', default=MAX_BACKOFF, type=int)
+        parser.add_argument('--engine', default='thread', choices=['thread', 'async'])
+        parser.add_argument('--concurrency', default=1000, type=int)
+        parser.add_argument('--connections', default=100, type=int)
+        parser.add_argument('--node', default=None)
+        parser.add_argument('--lease-ttl', default=LEASE_TTL, type=int)
+        parser.add_argument('--batch-search', default=1, type=int)
+        parser.add_argument('--ingest-threads', default=2, type=int)
+        parser.add_argument('--publish-threads', default=2, type=int)
+        parser.add_argument('--destroy-threads', default=1, type=int)
+        parser.add_argument('--queue-size', default=QUEUE_SIZE, type=int)
+        parser.add_argument('--thumbnail-processes', default=None, type=int)
+        parser.add_argument('--metrics-port', default=None, type=int)
+        parser.add_argument('--min-concurrency', default=1, type=int)
+        parser.add_argument('--fixed-concurrency', action='store_true')
+        parser.add_argument('--single-writer', action='store_true')
 
     def handle(self, *args, **options):
         setting = AppSetting.get_solo()
@@ -87,26 +150,94 @@ class Command(BaseCommand):
 
         threads = options['threads']
 
-        q = queue.Queue(maxsize=threads)
+        # 웹훅으로 트윗을 받을 때는 검색은 빠진 트윗을 찾는 용도로만 드물게 돈다.
+        delay = setting.reconcile_delay if setting.webhook_env else setting.batch_delay
 
-        workers = [Worker(f"Worker-{i}", q, setting.batch_delay) for i in range(threads)]
+        scheduler = Scheduler(delay, options['max_backoff'])
+        leases = LeaseManager(options['node'], options['lease_ttl'], options['lease_ttl'])
+
+        pipeline = Pipeline(scheduler, leases.name, options['ingest_threads'], options['publish_threads'],
+                            options['destroy_threads'], options['queue_size'], options['thumbnail_processes'])
+
+        logs.start()
+
+        if options['metrics_port'] is not None:
+            metrics.gauge("scheduled_users", lambda: len(scheduler))
+            metrics.gauge("rate_limit_remaining", ratelimit.headroom)
+            metrics.serve(options['metrics_port'])
+
+        logger.info("%s 시작", leases.name)
+
+        writer = None
+
+        if options['single_writer']:
+            # SQLite처럼 쓰기를 한 번에 하나만 받는 DB에서는 워커와 파이프라인의 쓰기를 한 스레드로 모아서 묶어 커밋한다.
+            writer = db.Writer()
+            writer.start()
+            db.set_writer(writer)
+
+        pipeline.start()
+
+        # threads(async는 --concurrency)는 이제 상한이다. 실제로 동시에 몇 개를 보낼지는 트위터 응답을 보고 정한다.
+        limit = options['concurrency'] if options['engine'] == 'async' else threads
+        limiter = None
+
+        if not options['fixed_concurrency']:
+            limiter = concurrency.AdaptiveLimiter("poll", limit, options['min_concurrency'],
+                                                  breaker=concurrency.upstream)
+
+        if options['engine'] == 'async':
+            from tmdnlcl_app.aio import AsyncEngine
+
+            engine = AsyncEngine(scheduler, leases, pipeline, threads, options['concurrency'], options['connections'],
+                                 limiter)
+
+            try:
+                asyncio.run(engine.run())
+            except KeyboardInterrupt:
+                logger.info("종료중...")
+            finally:
+                pipeline.stop()
+                self.stop_writer(writer)
+                leases.release()
+                logs.stop()
+
+            return
+
+        workers = [Worker(f"Worker-{i}", scheduler, leases, pipeline, options['batch_search'], limiter)
+                   for i in range(threads)]
+
+        metrics.gauge("stage_workers", lambda: len(workers), stage="Search")
+        metrics.gauge("stage_busy_workers", lambda: sum(worker.busy for worker in workers), stage="Search")
 
         for worker in workers:
             worker.start()
 
         while True:
             try:
-                for user in TwitterUser.objects.all().order_by('last_update'):
-                    q.put(user.id)
+                try:
+                    sync_users(scheduler, leases, pipeline)
+                except Exception:
+                    # DB가 잠깐 잠기거나 끊겨도 배치 전체가 멈추지 않게 다음 주기에 다시 한다.
+                    logger.exception("사용자 동기화 실패")
 
-                Tweet.objects.filter(submitted_at__gte=pendulum.now().subtract(days=-1)).delete()
+                time.sleep(SYNC_INTERVAL)
             except KeyboardInterrupt:
-                print("종료중...")
+                logger.info("종료중...")
                 break
 
-        print("작업 종료 대기중...")
-        q.join()
+        logger.info("작업 종료 대기중...")
 
         for worker in workers:
             worker.exit.set()
             worker.join()
+
+        pipeline.stop()
+        self.stop_writer(writer)
+        leases.release()
+        logs.stop()
+
+    def stop_writer(self, writer):
+        if writer is not None:
+            db.set_writer(None)
+            writer.stop()
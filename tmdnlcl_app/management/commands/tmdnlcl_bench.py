@@ -0,0 +1,406 @@
+import os
+import json
+import time
+import random
+import timeit
+import resource
+import tempfile
+import threading
+import contextlib
+
+import pendulum
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from heconvert.converter import e2h as heconvert_e2h, h2e
+
+from tmdnlcl_app import concurrency, db, hangul, metrics, webhooks
+from tmdnlcl_app.batch import sync_users
+from tmdnlcl_app.fake_twitter import FakeTwitter, RATE_LIMIT, VIDEO_SIZE, activity_event, user_token, screen_name
+from tmdnlcl_app.leases import LeaseManager
+from tmdnlcl_app.management.commands.tmdnlcl_batch import Worker
+from tmdnlcl_app.models import AppSetting, Attachment, Tweet, TwitterUser
+from tmdnlcl_app.pipeline import Pipeline
+from tmdnlcl_app.scheduler import Scheduler
+
+
+def heconvert_word_by_word(text):
+    words = []
+
+    for word in text.split(' '):
+        try:
+            words.append(heconvert_e2h(word))
+        except KeyError:
+            words.append(word)
+
+    return ' '.join(words)
+
+
+def random_hangul_text(rng, words):
+    return ' '.join(
+        ''.join(chr(0xAC00 + rng.randrange(11172)) for _ in range(rng.randint(1, 5))) for _ in range(words)
+    )
+
+
+def bench_hangul(options):
+    rng = random.Random(options['seed'])
+    texts = [h2e(random_hangul_text(rng, options['words'])) for _ in range(options['samples'])]
+
+    def run(func):
+        return min(timeit.repeat(lambda: [func(text) for text in texts], number=options['number'], repeat=3))
+
+    calls = options['number'] * len(texts)
+
+    results = {
+        'heconvert': run(heconvert_word_by_word),
+        'hangul_uncached': run(hangul.e2h.__wrapped__),
+    }
+
+    hangul.e2h.cache_clear()
+    results['hangul_cached'] = run(hangul.e2h)
+
+    return {
+        'scenario': 'hangul',
+        'samples': len(texts),
+        'words': options['words'],
+        'calls': calls,
+        'us_per_call': {name: elapsed / calls * 1000000 for name, elapsed in results.items()},
+        'speedup': {name: results['heconvert'] / elapsed for name, elapsed in results.items()},
+    }
+
+
+def percentile(values, p):
+    if not values:
+        return None
+
+    values = sorted(values)
+
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def latency_summary(values, scale=1000):
+    return {
+        'p50': percentile(values, 50) * scale if values else None,
+        'p99': percentile(values, 99) * scale if values else None,
+        'max': max(values) * scale if values else None,
+    }
+
+
+def peak_rss_kb():
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+class QueryCounter:
+    # 모든 스레드의 DB 연결에 붙어서 실행된 쿼리 수를 센다.
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self.lock:
+            self.count += 1
+
+        return execute(sql, params, many, context)
+
+    def attach(self, sender, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def install(self):
+        connection_created.connect(self.attach)
+        self.attach(None, connection)
+
+    def uninstall(self):
+        connection_created.disconnect(self.attach)
+
+        if self in connection.execute_wrappers:
+            connection.execute_wrappers.remove(self)
+
+
+@contextlib.contextmanager
+def bench_environment(options):
+    # 실제 DB와 미디어 폴더는 건드리지 않도록 임시 DB와 임시 폴더에서 가짜 트위터 서버를 상대로 돌린다.
+    with tempfile.TemporaryDirectory() as directory:
+        if connection.vendor == 'sqlite':
+            connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'bench.sqlite3')
+
+        old_name = connection.settings_dict['NAME']
+
+        setup_test_environment()
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        cache.clear()
+        metrics.reset()
+
+        fake = FakeTwitter(options['latency'], options['rate_limit'], error_rate=options['error_rate'],
+                           image_size=(options['image_width'], options['image_height']),
+                           video_size=options['video_size'], seed=options['seed'])
+        fake.start()
+        fake.install()
+
+        setting = AppSetting.get_solo()
+        setting.twitter_api_key = 'bench'
+        setting.twitter_api_secret = 'bench'
+        setting.batch_delay = options['delay']
+        setting.save()
+
+        counter = QueryCounter()
+        counter.install()
+
+        try:
+            with override_settings(MEDIA_ROOT=os.path.join(directory, 'media')):
+                yield fake, counter
+        finally:
+            counter.uninstall()
+            fake.stop()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+
+def make_users(fake, count):
+    users = []
+
+    for user_id in range(1, count + 1):
+        fake.add_user(user_id)
+
+        users.append(TwitterUser.objects.create(
+            id=user_id,
+            oauth_token=user_token(user_id),
+            oauth_token_secret='bench',
+            screen_name=screen_name(user_id),
+            screen_name_updated_at=pendulum.now(),
+            mode=TwitterUser.MODE_INSTANT,
+        ))
+
+    return users
+
+
+def bench_from_raw_tweet(options):
+    with bench_environment(options) as (fake, counter):
+        user, = make_users(fake, 1)
+        statuses = [fake.add_tweet(user.id, options['photos'], options['video']) for _ in range(options['samples'])]
+
+        queries = counter.count
+        durations = []
+
+        for status in statuses:
+            started = time.monotonic()
+            Tweet.from_raw_tweet(user, status)
+            durations.append(time.monotonic() - started)
+
+        return {
+            'scenario': 'from_raw_tweet',
+            'tweets': len(statuses),
+            'photos': options['photos'],
+            'video': options['video'],
+            'tweets_per_sec': len(durations) / sum(durations),
+            'latency_ms': latency_summary(durations),
+            'queries_per_tweet': (counter.count - queries) / len(statuses),
+            'peak_rss_kb': peak_rss_kb(),
+        }
+
+
+def bench_post(options):
+    with bench_environment(options) as (fake, counter):
+        user, = make_users(fake, 1)
+        tweets = [Tweet.from_raw_tweet(user, fake.add_tweet(user.id, options['photos'], options['video']))
+                  for _ in range(options['samples'])]
+
+        queries = counter.count
+        durations = []
+
+        for tweet in tweets:
+            started = time.monotonic()
+            tweet.post()
+            durations.append(time.monotonic() - started)
+
+        return {
+            'scenario': 'post',
+            'tweets': len(tweets),
+            'photos': options['photos'],
+            'video': options['video'],
+            'posts_per_sec': len(durations) / sum(durations),
+            'latency_ms': latency_summary(durations),
+            'queries_per_post': (counter.count - queries) / len(tweets),
+            'peak_rss_kb': peak_rss_kb(),
+        }
+
+
+def bench_index(options):
+    with bench_environment(options) as (fake, counter):
+        user, = make_users(fake, 1)
+
+        Tweet.objects.bulk_create([
+            Tweet(id=tweet_id, user=user, content=f"&gt;dkssud&lt; {tweet_id}", converted_content=f"안녕 {tweet_id}")
+            for tweet_id in range(1, options['samples'] + 1)
+        ])
+        Attachment.objects.bulk_create([
+            Attachment(tweet_id=tweet_id, type=Attachment.PHOTO, ext='jpg', file=f"{tweet_id}.jpg",
+                       thumbnail=f"{tweet_id}_thumb.jpg")
+            for tweet_id in range(1, options['samples'] + 1)
+        ])
+
+        client = Client()
+        session = client.session
+        session['user_id'] = user.id
+        session.save()
+
+        queries = counter.count
+        durations = []
+
+        for _ in range(options['number']):
+            started = time.monotonic()
+            response = client.get('/')
+            durations.append(time.monotonic() - started)
+
+            assert response.status_code == 200
+
+        return {
+            'scenario': 'index',
+            'tweets': options['samples'],
+            'requests': len(durations),
+            'requests_per_sec': len(durations) / sum(durations),
+            'latency_ms': latency_summary(durations),
+            'queries_per_request': (counter.count - queries) / len(durations),
+            'peak_rss_kb': peak_rss_kb(),
+        }
+
+
+def bench_batch(options):
+    with bench_environment(options) as (fake, counter):
+        rng = random.Random(options['seed'])
+        users = make_users(fake, options['users'])
+
+        scheduler = Scheduler(options['delay'], options['delay'])
+        leases = LeaseManager("bench")
+        pipeline = Pipeline(scheduler, leases.name, options['ingest_threads'], options['publish_threads'],
+                            options['destroy_threads'])
+
+        limiter = None
+
+        if not options['fixed_concurrency']:
+            limiter = concurrency.AdaptiveLimiter("poll", options['threads'], breaker=concurrency.upstream)
+
+        writer = None
+
+        if options['single_writer']:
+            writer = db.Writer()
+            writer.start()
+            db.set_writer(writer)
+
+        pipeline.start()
+        sync_users(scheduler, leases, pipeline)
+
+        workers = [Worker(f"Worker-{i}", scheduler, leases, pipeline, options['batch_search'], limiter)
+                   for i in range(options['threads'])]
+
+        for worker in workers:
+            worker.start()
+
+        client = Client()
+        started = time.monotonic()
+        synced = started
+        created = 0
+
+        # 정해진 시간 동안 일정한 속도로 트윗을 만들고, 끝난 뒤에는 남은 트윗이 다시 올라올 때까지 기다린다.
+        while time.monotonic() - started < options['duration']:
+            status = fake.add_tweet(rng.choice(users).id, options['photos'], options['video'])
+            created += 1
+
+            if options['webhook']:
+                # 트위터가 보내는 것처럼 서명해서 웹훅 엔드포인트로 넘긴다. 검색은 --delay 간격의 재확인만 한다.
+                body = json.dumps(activity_event(status)).encode()
+                client.post('/webhooks/twitter', body, content_type='application/json',
+                            HTTP_X_TWITTER_WEBHOOKS_SIGNATURE=webhooks.sign('bench', body))
+
+            if time.monotonic() - synced > options['duration'] / 3:
+                sync_users(scheduler, leases, pipeline)
+                synced = time.monotonic()
+
+            time.sleep(1 / options['tweet_rate'])
+
+        elapsed = time.monotonic() - started
+        polls = metrics.total("polls_total")
+
+        deadline = time.monotonic() + options['drain']
+
+        while fake.pending_reposts() and time.monotonic() < deadline:
+            time.sleep(0.1)
+
+        for worker in workers:
+            worker.exit.set()
+            worker.join()
+
+        pipeline.stop()
+
+        if writer is not None:
+            db.set_writer(None)
+            writer.stop()
+
+        leases.release()
+
+        return {
+            'scenario': 'batch',
+            'webhook': options['webhook'],
+            'single_writer': options['single_writer'],
+            'users': len(users),
+            'threads': options['threads'],
+            'poll_concurrency': int(limiter.limit) if limiter is not None else options['threads'],
+            'duration': elapsed,
+            'polls': polls,
+            'polls_per_sec': polls / elapsed,
+            'tweets_created': created,
+            'tweets_reposted': len(fake.repost_latencies),
+            'repost_latency_ms': latency_summary(fake.repost_latencies),
+            'errors': metrics.total("errors_total"),
+            'queries': counter.count,
+            'queries_per_poll': counter.count / polls if polls else None,
+            'peak_rss_kb': peak_rss_kb(),
+            'requests': dict(sorted(fake.requests.items())),
+        }
+
+
+SCENARIOS = {
+    'hangul': bench_hangul,
+    'from_raw_tweet': bench_from_raw_tweet,
+    'post': bench_post,
+    'index': bench_index,
+    'batch': bench_batch,
+}
+
+
+class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=sorted(SCENARIOS))
+        parser.add_argument('--seed', default=0, type=int)
+        parser.add_argument('--samples', default=200, type=int)
+        parser.add_argument('--words', default=20, type=int)
+        parser.add_argument('--number', default=10, type=int)
+        parser.add_argument('--users', default=20, type=int)
+        parser.add_argument('--threads', default=4, type=int)
+        parser.add_argument('--batch-search', default=1, type=int)
+        parser.add_argument('--ingest-threads', default=2, type=int)
+        parser.add_argument('--publish-threads', default=2, type=int)
+        parser.add_argument('--destroy-threads', default=1, type=int)
+        parser.add_argument('--delay', default=1, type=int)
+        parser.add_argument('--duration', default=30, type=int)
+        parser.add_argument('--drain', default=30, type=int)
+        parser.add_argument('--tweet-rate', default=5, type=float)
+        parser.add_argument('--webhook', action='store_true')
+        parser.add_argument('--fixed-concurrency', action='store_true')
+        parser.add_argument('--single-writer', action='store_true')
+        parser.add_argument('--photos', default=1, type=int)
+        parser.add_argument('--video', action='store_true')
+        parser.add_argument('--video-size', default=VIDEO_SIZE, type=int)
+        parser.add_argument('--latency', default=0.0, type=float)
+        parser.add_argument('--rate-limit', default=RATE_LIMIT, type=int)
+        parser.add_argument('--error-rate', default=0.0, type=float)
+        parser.add_argument('--image-width', default=1200, type=int)
+        parser.add_argument('--image-height', default=800, type=int)
+
+    def handle(self, *args, **options):
+        self.stdout.write(json.dumps(SCENARIOS[options['scenario']](options), indent=2))
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tmdnlcl_app import retention, stats
+
+
+class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument('--days', default=None, type=int)
+        parser.add_argument('--chunk-size', default=retention.CHUNK_SIZE, type=int)
+        parser.add_argument('--interval', default=0, type=int)
+        parser.add_argument('--grace-period', default=retention.GC_GRACE_PERIOD, type=int)
+        parser.add_argument('--verify', action='store_true')
+
+    def handle(self, *args, **options):
+        while True:
+            result = retention.purge(options['days'], options['chunk_size'])
+
+            print(f"[Retention] 트윗 {result['tweets']}개 삭제 "
+                  f"({result['elapsed']:.2f}초, 초당 {result['tweets_per_sec']:.1f}개)")
+
+            media = retention.collect_media(options['grace_period'], options['verify'])
+
+            print(f"[Retention] 파일 {media['files']}개 중 {media['deleted']}개 삭제 "
+                  f"({media['freed'] / 1024 / 1024:.1f}MB 확보)")
+
+            for name in media['corrupted']:
+                print(f"[Retention] {name} 파일 내용이 해시와 다름")
+
+            # 시그널을 거치지 않고 지워진 사용자가 있을 수 있으니 사용자 수를 다시 센다.
+            print(f"[Retention] 사용자 {stats.update_stats()['total_users']}명")
+
+            if options['interval'] <= 0:
+                break
+
+            try:
+                time.sleep(options['interval'])
+            except KeyboardInterrupt:
+                print("종료중...")
+                break
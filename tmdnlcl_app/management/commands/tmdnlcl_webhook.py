@@ -0,0 +1,75 @@
+import sys
+import json
+import secrets
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from twython import TwythonError
+
+from tmdnlcl_app import webhooks
+from tmdnlcl_app.models import AppSetting, TwitterUser
+
+
+class Command(BaseCommand):
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='action')
+        subparsers.required = True
+
+        subparsers.add_parser('subscribe')
+
+        crc = subparsers.add_parser('crc')
+        crc.add_argument('url')
+
+        replay = subparsers.add_parser('replay')
+        replay.add_argument('url')
+        replay.add_argument('events', nargs='?', default='-')
+        replay.add_argument('--bad-signature', action='store_true')
+
+    def handle(self, *args, **options):
+        setting = AppSetting.get_solo()
+
+        if not setting.twitter_api_secret:
+            raise CommandError("twitter_api_secret이 없습니다.")
+
+        getattr(self, options['action'])(setting, options)
+
+    def subscribe(self, setting, options):
+        if not setting.webhook_env:
+            raise CommandError("webhook_env가 없습니다.")
+
+        for user in TwitterUser.objects.all():
+            try:
+                user.subscribe_webhook()
+                print(f"[Webhook] {user.id} 구독함")
+            except TwythonError as e:
+                print(f"[Webhook] {user.id} 구독 실패: {e}")
+
+    def crc(self, setting, options):
+        # 트위터가 보내는 것과 같은 CRC 요청을 보내서 응답이 맞는지 확인한다.
+        crc_token = secrets.token_urlsafe(32)
+        response = requests.get(options['url'], params={'crc_token': crc_token})
+        expected = webhooks.crc_response(setting.twitter_api_secret, crc_token)
+
+        ok = response.status_code == 200 and response.json() == expected
+        print(f"[Webhook] CRC {'성공' if ok else '실패'} ({response.status_code})")
+
+    def replay(self, setting, options):
+        # 한 줄에 이벤트 하나씩 든 JSON 파일을 트위터처럼 서명해서 보낸다.
+        events = sys.stdin if options['events'] == '-' else open(options['events'], encoding='utf-8')
+
+        with events, requests.Session() as session:
+            for line in events:
+                line = line.strip()
+
+                if not line:
+                    continue
+
+                body = json.dumps(json.loads(line)).encode()
+                secret = setting.twitter_api_secret + ('x' if options['bad_signature'] else '')
+
+                response = session.post(options['url'], data=body, headers={
+                    'Content-Type': 'application/json',
+                    'X-Twitter-Webhooks-Signature': webhooks.sign(secret, body),
+                })
+
+                print(f"[Webhook] {response.status_code} {len(body)}바이트")
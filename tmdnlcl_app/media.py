@@ -0,0 +1,157 @@
+import io
+import os
+import time
+import tempfile
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.files import File
+from twython import TwythonError
+
+from tmdnlcl_app import concurrency, metrics, ratelimit
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_TIMEOUT = 30
+DOWNLOAD_WORKERS = 8
+
+UPLOAD_URL = "https://upload.twitter.com/1.1/media/upload.json"
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+UPLOAD_RETRIES = 3
+UPLOAD_RETRY_DELAY = 2
+UPLOAD_WORKERS = 8
+
+_session = requests.Session()
+_session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=DOWNLOAD_WORKERS))
+
+_executor = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS, thread_name_prefix="tmdnlcl-media")
+_upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="tmdnlcl-upload")
+
+# 파일 크기마다 걸리는 시간이 달라서 업로드는 지연 시간은 보지 않고 에러와 429로만 동시 업로드 수를 조절한다.
+upload_limiter = concurrency.AdaptiveLimiter("upload", UPLOAD_WORKERS, breaker=concurrency.upstream,
+                                             latency_tolerance=None)
+
+
+def set_transport(adapter):
+    _session.mount('https://', adapter)
+    _session.mount('http://', adapter)
+
+
+def download(url):
+    temp = tempfile.TemporaryFile()
+
+    try:
+        with metrics.timed("download"), _session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                temp.write(chunk)
+    except Exception:
+        temp.close()
+        raise
+
+    metrics.inc("download_bytes_total", temp.tell())
+    temp.seek(0)
+
+    return File(temp)
+
+
+@contextlib.contextmanager
+def fetch_all(urls):
+    futures = {url: _executor.submit(download, url) for url in dict.fromkeys(urls)}
+
+    try:
+        yield {url: future.result() for url, future in futures.items()}
+    finally:
+        for future in futures.values():
+            if future.exception() is None:
+                future.result().close()
+
+
+def retry(func, retries=UPLOAD_RETRIES, delay=UPLOAD_RETRY_DELAY):
+    for attempt in range(retries):
+        try:
+            return func()
+        except (TwythonError, requests.RequestException) as e:
+            if isinstance(e, TwythonError) and e.error_code is not None and e.error_code < 500:
+                raise
+
+            if attempt == retries - 1:
+                raise
+
+            time.sleep(delay * 2 ** attempt)
+
+
+def upload_photo(twitter, path, limit_key=None):
+    with open(path, "rb") as f:
+        def upload():
+            f.seek(0)
+
+            if limit_key is None:
+                return twitter.upload_media(media=f)
+
+            return ratelimit.call(limit_key, twitter.upload_media, media=f)
+
+        return retry(upload)['media_id']
+
+
+def upload_video(twitter, path, media_type='video/mp4', limit_key=None):
+    if limit_key is not None:
+        ratelimit.acquire(limit_key)
+
+    response = twitter.post(UPLOAD_URL, params={
+        'command': 'INIT',
+        'media_type': media_type,
+        'media_category': 'tweet_video',
+        'total_bytes': os.path.getsize(path),
+    })
+    media_id = response['media_id']
+
+    with open(path, "rb") as f:
+        segment_index = 0
+
+        while True:
+            data = f.read(UPLOAD_CHUNK_SIZE)
+
+            if not data:
+                break
+
+            # 실패한 조각만 다시 보내고 이어서 올린다. Twython은 params 안의 파일 객체를 multipart로 보낸다.
+            retry(lambda: twitter.post(UPLOAD_URL, params={
+                'command': 'APPEND',
+                'media_id': media_id,
+                'segment_index': segment_index,
+                'media': io.BytesIO(data),
+            }))
+
+            segment_index += 1
+
+    response = twitter.post(UPLOAD_URL, params={'command': 'FINALIZE', 'media_id': media_id})
+    processing_info = response.get('processing_info')
+
+    while processing_info is not None and processing_info['state'] in ('pending', 'in_progress'):
+        time.sleep(processing_info.get('check_after_secs', 1))
+
+        response = twitter.get(UPLOAD_URL, params={'command': 'STATUS', 'media_id': media_id})
+        processing_info = response.get('processing_info')
+
+    if processing_info is not None and processing_info['state'] == 'failed':
+        raise TwythonError(f"Media processing failed: {processing_info.get('error')}")
+
+    return media_id
+
+
+def timed_upload(upload, *args, **kwargs):
+    with upload_limiter.slot(), metrics.timed("upload"):
+        return upload(*args, **kwargs)
+
+
+def upload_all(twitter, files, limit_key=None):
+    # files: (path, is_video) 목록. 트윗에 붙는 순서대로 media_id를 돌려준다.
+    futures = []
+
+    for path, is_video in files:
+        upload = upload_video if is_video else upload_photo
+        futures.append(_upload_executor.submit(timed_upload, upload, twitter, path, limit_key=limit_key))
+
+    return [future.result() for future in futures]
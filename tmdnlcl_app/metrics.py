@@ -0,0 +1,170 @@
+import bisect
+import time
+import threading
+import logging
+import contextlib
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from django.db import connections
+
+PREFIX = "tmdnlcl"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_gauges = {}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    key = _key(name, labels)
+
+    with _lock:
+        histogram = _histograms.get(key)
+
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * (len(LATENCY_BUCKETS) + 1), 0, 0.0]
+
+        histogram[0][bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        histogram[1] += 1
+        histogram[2] += value
+
+
+def gauge(name, func, **labels):
+    # func은 수집할 때마다 불려서 현재 값을 돌려준다. 여러 값이면 (라벨 dict, 값) 목록을 돌려준다.
+    with _lock:
+        _gauges[_key(name, labels)] = func
+
+
+@contextlib.contextmanager
+def timed(operation, **labels):
+    started = time.monotonic()
+
+    try:
+        yield
+    except BaseException:
+        inc("errors_total", operation=operation, **labels)
+        raise
+    finally:
+        observe("duration_seconds", time.monotonic() - started, operation=operation, **labels)
+
+
+def total(name):
+    with _lock:
+        return sum(value for (counter, _), value in _counters.items() if counter == name)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+        _gauges.clear()
+
+
+def _format_labels(labels, extra=()):
+    labels = tuple(labels) + tuple(extra)
+
+    if not labels:
+        return ""
+
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: (list(buckets), count, total) for key, (buckets, count, total) in _histograms.items()}
+        gauges = dict(_gauges)
+
+    lines = []
+    declared = set()
+
+    def declare(name, kind):
+        if name not in declared:
+            declared.add(name)
+            lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+
+    for (name, labels), value in sorted(counters.items()):
+        declare(name, "counter")
+        lines.append(f"{PREFIX}_{name}{_format_labels(labels)} {_format_value(value)}")
+
+    for (name, labels), (buckets, count, total) in sorted(histograms.items()):
+        declare(name, "histogram")
+
+        cumulative = 0
+
+        for bound, bucket in zip(LATENCY_BUCKETS + ("+Inf",), buckets):
+            cumulative += bucket
+            lines.append(f"{PREFIX}_{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+
+        lines.append(f"{PREFIX}_{name}_sum{_format_labels(labels)} {_format_value(total)}")
+        lines.append(f"{PREFIX}_{name}_count{_format_labels(labels)} {count}")
+
+    for (name, labels), func in sorted(gauges.items(), key=lambda item: item[0]):
+        try:
+            value = func()
+        except Exception:
+            logger.exception("%s 게이지 수집 실패", name)
+            continue
+
+        declare(name, "gauge")
+
+        if isinstance(value, (list, tuple)):
+            for extra, item in value:
+                lines.append(f"{PREFIX}_{name}{_format_labels(labels, sorted(extra.items()))} {_format_value(item)}")
+        else:
+            lines.append(f"{PREFIX}_{name}{_format_labels(labels)} {_format_value(value)}")
+
+    return "\n".join(lines) + "\n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        try:
+            body = render().encode()
+        finally:
+            # 요청마다 새 스레드라서 게이지가 연 DB 연결을 여기서 닫는다.
+            connections.close_all()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve(port, address=''):
+    server = _Server((address, port), _Handler)
+    threading.Thread(target=server.serve_forever, name="Metrics", daemon=True).start()
+
+    return server
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tmdnlcl_app', '0004_auto_20181214_0209'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='twitteruser',
+            name='screen_name',
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name='twitteruser',
+            name='screen_name_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
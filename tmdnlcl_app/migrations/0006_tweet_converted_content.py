@@ -0,0 +1,51 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:29
+
+import re
+
+from django.db import migrations, models
+
+from tmdnlcl_app.hangul import e2h
+
+# 이 마이그레이션을 만들 때의 변환 규칙을 그대로 둔다. models.convert_content가 바뀌어도 결과가 달라지지 않는다.
+INSTANT_PATTERN = re.compile(r"(&gt;.+?&lt;)")
+ARCHIVE_TAG = "//"
+MODE_INSTANT = 1
+BATCH_SIZE = 500
+
+
+def convert_content(content, mode):
+    text = content.strip()
+
+    if mode == MODE_INSTANT:
+        text = re.sub(INSTANT_PATTERN, lambda match_obj: e2h(match_obj.group(0)[4:-4]), text)
+    elif text.startswith(ARCHIVE_TAG):
+        text = text[len(ARCHIVE_TAG):]
+
+    return text
+
+
+def fill_converted_content(apps, schema_editor):
+    Tweet = apps.get_model('tmdnlcl_app', 'Tweet')
+
+    tweets = list(Tweet.objects.select_related('user'))
+
+    for tweet in tweets:
+        tweet.converted_content = convert_content(tweet.content, tweet.user.mode)
+
+    Tweet.objects.bulk_update(tweets, ['converted_content'], batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tmdnlcl_app', '0005_twitteruser_screen_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tweet',
+            name='converted_content',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RunPython(fill_converted_content, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tmdnlcl_app', '0006_tweet_converted_content'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServiceStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_users', models.IntegerField(default=0)),
+                ('last_update', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
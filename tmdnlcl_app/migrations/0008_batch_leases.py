@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tmdnlcl_app', '0007_servicestats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BatchNode',
+            fields=[
+                ('name', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('heartbeat_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='twitteruser',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='twitteruser',
+            name='lease_owner',
+            field=models.CharField(blank=True, db_index=True, max_length=255, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tmdnlcl_app', '0008_batch_leases'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='twitteruser',
+            name='protected',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tmdnlcl_app', '0009_twitteruser_protected'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateLimit',
+            fields=[
+                ('key', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('remaining', models.IntegerField(blank=True, null=True)),
+                ('reset_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tmdnlcl_app', '0010_ratelimit'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxOperation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('kind', models.CharField(choices=[('publish', '업로드'), ('destroy', '원본 삭제')], max_length=10)),
+                ('tweet_id', models.BigIntegerField()),
+                ('delete_tweet', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('pending', '대기'), ('done', '완료'), ('failed', '실패')], db_index=True, default='pending', max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(db_index=True)),
+                ('locked_by', models.CharField(blank=True, max_length=255, null=True)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tmdnlcl_app.TwitterUser')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tmdnlcl_app', '0011_outboxoperation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appsetting',
+            name='retention_days',
+            field=models.IntegerField(default=1),
+        ),
+    ]
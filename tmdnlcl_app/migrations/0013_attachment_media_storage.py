@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:41
+
+from django.db import migrations, models
+import imagekit.models.fields
+import tmdnlcl_app.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tmdnlcl_app', '0012_appsetting_retention_days'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='attachment',
+            name='file',
+            field=models.FileField(storage=tmdnlcl_app.storage.ContentAddressedStorage(), upload_to=''),
+        ),
+        migrations.AlterField(
+            model_name='attachment',
+            name='thumbnail',
+            field=imagekit.models.fields.ProcessedImageField(storage=tmdnlcl_app.storage.ContentAddressedStorage(), upload_to=''),
+        ),
+    ]
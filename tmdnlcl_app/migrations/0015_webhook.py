@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tmdnlcl_app', '0014_attachment_thumbnail_source'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appsetting',
+            name='reconcile_delay',
+            field=models.IntegerField(default=600),
+        ),
+        migrations.AddField(
+            model_name='appsetting',
+            name='webhook_env',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='outboxoperation',
+            name='payload',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AlterField(
+            model_name='outboxoperation',
+            name='kind',
+            field=models.CharField(choices=[('publish', '업로드'), ('destroy', '원본 삭제'), ('ingest', '웹훅 수신')], max_length=10),
+        ),
+    ]
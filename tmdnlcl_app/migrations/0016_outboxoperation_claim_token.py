@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 16:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tmdnlcl_app', '0015_webhook'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxoperation',
+            name='claim_token',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+    ]
@@ -1,47 +1,80 @@
 import re
+import logging
+import collections
+
 import pendulum
 from imagekit.models import ProcessedImageField
 from imagekit.processors import ResizeToFit
 
-from heconvert.converter import e2h
-
-from django.db import models
-from django.core.files.base import ContentFile
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 
-import requests
 from solo.models import SingletonModel
 
-from twython import Twython, TwythonRateLimitError
+from twython import TwythonAuthError, TwythonRateLimitError
+
+from tmdnlcl_app.twitter import get_client, discard_client, get_app_client, discard_app_client, last_header
+from tmdnlcl_app.media import fetch_all, upload_all
+from tmdnlcl_app.hangul import e2h
+from tmdnlcl_app.storage import ContentAddressedStorage
+from tmdnlcl_app import metrics, ratelimit
 
 INSTANT_PATTERN = re.compile(r"(&gt;.+?&lt;)")
 ARCHIVE_TAG = "//"
 
+SEARCH_PAGE_SIZE = 100
+SEARCH_MAX_PAGES = 5
+SCREEN_NAME_TTL = 60 * 60 * 24
+SEARCH_QUERY_LIMIT = 500
+
+POLL_STATE_FIELDS = ['rate_limit_remaining', 'rate_limit_reset', 'last_tweet_id', 'last_update']
 
-def url_to_file(url):
-    return ContentFile(requests.get(url).content)
+media_storage = ContentAddressedStorage()
+
+logger = logging.getLogger(__name__)
 
 
 def safe_convert(match_obj):
-    text = match_obj.group(0)[4:-4]
+    return e2h(match_obj.group(0)[4:-4])
 
-    try:
-        words = []
 
-        for word in text.split(' '):
-            try:
-                words.append(e2h(word))
-            except KeyError:
-                words.append(word)
+def convert_content(content, mode):
+    text = content.strip()
+
+    if mode == TwitterUser.MODE_INSTANT:
+        text = re.sub(INSTANT_PATTERN, safe_convert, text)
+    else:
+        if text.startswith(ARCHIVE_TAG):
+            text = text[len(ARCHIVE_TAG):]
 
-        return ' '.join(words)
-    except KeyError:
-        return text
+    return text
 
 
 class AppSetting(SingletonModel):
     twitter_api_key = models.CharField(max_length=255, blank=True, null=True)
     twitter_api_secret = models.CharField(max_length=255, blank=True, null=True)
     batch_delay = models.IntegerField(default=5)
+    retention_days = models.IntegerField(default=1)
+    webhook_env = models.CharField(max_length=255, blank=True, null=True)
+    reconcile_delay = models.IntegerField(default=600)
+
+
+class ServiceStats(SingletonModel):
+    total_users = models.IntegerField(default=0)
+    last_update = models.DateTimeField(null=True, blank=True)
+
+
+class RateLimit(models.Model):
+    key = models.CharField(max_length=255, primary_key=True)
+    remaining = models.IntegerField(null=True, blank=True)
+    reset_at = models.DateTimeField(null=True, blank=True)
+
+
+class BatchNode(models.Model):
+    name = models.CharField(max_length=255, primary_key=True)
+    heartbeat_at = models.DateTimeField(db_index=True)
 
 
 class TwitterUser(models.Model):
@@ -61,37 +94,206 @@ class TwitterUser(models.Model):
     rate_limit_reset = models.DateTimeField(null=True, blank=True)
     mode = models.SmallIntegerField(default=MODE_ARCHIVE, choices=MODE_CHOICES, verbose_name="동작 방식")
     last_update = models.DateTimeField(auto_now=True, db_index=True)
+    screen_name = models.CharField(max_length=50, null=True, blank=True)
+    screen_name_updated_at = models.DateTimeField(null=True, blank=True)
+    protected = models.BooleanField(default=False)
+    lease_owner = models.CharField(max_length=255, null=True, blank=True, db_index=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
 
     def get_twitter_api(self):
         setting = AppSetting.get_solo()
-        return Twython(setting.twitter_api_key, setting.twitter_api_secret, self.oauth_token, self.oauth_token_secret)
+        return get_client(setting.twitter_api_key, setting.twitter_api_secret, self.oauth_token, self.oauth_token_secret)
+
+    def discard_twitter_api(self):
+        setting = AppSetting.get_solo()
+        discard_client(setting.twitter_api_key, setting.twitter_api_secret, self.oauth_token, self.oauth_token_secret)
 
     def get_user_info(self):
         twitter = self.get_twitter_api()
-        return twitter.show_user(user_id=self.id)
+        return ratelimit.call(f"users/show:{self.id}", twitter.show_user, user_id=self.id)
+
+    def get_screen_name(self, refresh=False):
+        expired = self.screen_name_updated_at is None or \
+            self.screen_name_updated_at < pendulum.now().subtract(seconds=SCREEN_NAME_TTL)
+
+        if refresh or self.screen_name is None or expired:
+            self.set_user_info(self.get_user_info())
+
+        return self.screen_name
+
+    def subscribe_webhook(self):
+        # 웹훅 환경이 정해져 있으면 이 사용자의 계정 활동을 웹훅으로 받는다.
+        setting = AppSetting.get_solo()
+
+        if not setting.webhook_env:
+            return False
+
+        twitter = self.get_twitter_api()
+        twitter.post(f"account_activity/all/{setting.webhook_env}/subscriptions")
+
+        return True
+
+    def set_user_info(self, info):
+        self.screen_name = info['screen_name']
+        self.protected = info.get('protected', False)
+        self.screen_name_updated_at = pendulum.now()
+        self.save(update_fields=['screen_name', 'protected', 'screen_name_updated_at'])
+
+    @classmethod
+    def search_tweets_many(cls, users, keyword):
+        # 앱 인증으로 여러 사용자를 한 번에 검색한다. 비공개 계정처럼 사용자 토큰이 필요한 경우나 페이지 한도에 걸려
+        # 커서가 뒤처진 사용자는 결과에서 빠지므로 호출하는 쪽에서 개별 검색으로 처리해야 한다.
+        setting = AppSetting.get_solo()
+
+        results = {}
+
+        for group in cls.group_for_search(users, keyword):
+            try:
+                tweets = cls._search_tweets_many(get_app_client(setting.twitter_api_key, setting.twitter_api_secret),
+                                                 group, keyword)
+            except (TwythonRateLimitError, ratelimit.RateLimited):
+                break
+            except TwythonAuthError:
+                discard_app_client(setting.twitter_api_key, setting.twitter_api_secret)
+                break
+
+            results.update(tweets)
+
+        return results
+
+    @classmethod
+    def group_for_search(cls, users, keyword):
+        groups = []
+        group = []
+
+        for user in users:
+            if user.protected or user.screen_name is None:
+                continue
+
+            query = cls.build_search_query(group + [user], keyword)
+
+            if group and len(query) > SEARCH_QUERY_LIMIT:
+                groups.append(group)
+                group = []
+
+            group.append(user)
+
+        if group:
+            groups.append(group)
+
+        return groups
+
+    @staticmethod
+    def build_search_query(users, keyword):
+        return f"({' OR '.join(f'from:{user.screen_name}' for user in users)}) {keyword}"
+
+    @classmethod
+    def _search_tweets_many(cls, twitter, users, keyword):
+        since_ids = [user.last_tweet_id for user in users]
+
+        params = {'q': cls.build_search_query(users, keyword), 'result_type': 'recent', 'count': SEARCH_PAGE_SIZE}
+
+        if None not in since_ids:
+            params['since_id'] = min(since_ids)
+
+        tweets = []
+        truncated = False
+
+        for page in range(SEARCH_MAX_PAGES):
+            statuses = ratelimit.call("search:app", twitter.search, **params)['statuses']
+            tweets.extend(statuses)
+
+            if len(statuses) < SEARCH_PAGE_SIZE:
+                break
+
+            params['max_id'] = min(status['id'] for status in statuses) - 1
+            truncated = page == SEARCH_MAX_PAGES - 1
+
+        if truncated:
+            # 페이지 한도에 걸리면 받은 것보다 오래된 트윗은 잘려나간다. 커서가 그보다 뒤처진 사용자는 결과에서 빼서
+            # 커서가 잘린 트윗을 건너뛰지 않게 하고, 호출하는 쪽에서 개별 검색으로 처리하게 한다.
+            oldest = params['max_id']
+            users = [user for user in users if user.last_tweet_id is not None and user.last_tweet_id >= oldest]
+
+        owners = {user.id: user for user in users}
+        results = {user.id: {} for user in users}
+
+        for tweet in tweets:
+            owner = owners.get(tweet['user']['id'])
+
+            if owner is not None and (owner.last_tweet_id is None or tweet['id'] > owner.last_tweet_id):
+                results[owner.id][tweet['id']] = tweet
+
+        return {user_id: sorted(tweets.values(), key=lambda tweet: tweet['id']) for user_id, tweets in results.items()}
 
     def search_tweets(self, keyword):
         if self.rate_limit_remaining == 0 and pendulum.now() < self.rate_limit_reset:
             return []
 
+        try:
+            return self._search_tweets(keyword, self.get_screen_name())
+        except TwythonAuthError:
+            # 캐시된 클라이언트나 바뀐 계정 정보 때문일 수 있으니 한 번은 새로 받아서 다시 시도한다.
+            self.discard_twitter_api()
+            return self._search_tweets(keyword, self.get_screen_name(refresh=True))
+
+    def _search_tweets(self, keyword, screen_name):
         twitter = self.get_twitter_api()
-        screen_name = self.get_user_info()['screen_name']
+
+        params = {'q': f"from:{screen_name} {keyword}", 'result_type': 'recent', 'count': SEARCH_PAGE_SIZE}
+
+        if self.last_tweet_id is not None:
+            params['since_id'] = self.last_tweet_id
+
+        tweets = []
+        truncated = False
 
         try:
-            tweets = twitter.search(q=f"from:{screen_name} {keyword}", result_type='recent')['statuses']
+            for page in range(SEARCH_MAX_PAGES):
+                statuses = ratelimit.call(f"search:{self.id}", twitter.search, **params)['statuses']
+                self.update_rate_limit()
+
+                tweets.extend(statuses)
+
+                if len(statuses) < SEARCH_PAGE_SIZE:
+                    break
+
+                params['max_id'] = min(status['id'] for status in statuses) - 1
+                truncated = page == SEARCH_MAX_PAGES - 1
         except TwythonRateLimitError:
+            # 중간에 끊긴 페이지는 since_id 이후 구간이 비어버리므로 다음 탐색에서 처음부터 다시 받는다.
+            self.update_rate_limit()
+            tweets = []
+        except ratelimit.RateLimited as e:
+            self.rate_limit_remaining = 0
+            self.rate_limit_reset = e.reset_at
             tweets = []
 
-        self.rate_limit_remaining = int(twitter.get_lastfunction_header('X-Rate-Limit-Remaining', None))
+        if truncated and self.last_tweet_id is not None:
+            # 개별 검색은 더 넘길 곳이 없다. 받은 것보다 오래된 트윗은 커서가 넘어가면서 빠지므로 알 수 있게 남긴다.
+            logger.warning("%s 검색이 %s페이지에서 잘림: %s ~ %s 사이 트윗 빠짐",
+                           self.id, SEARCH_MAX_PAGES, self.last_tweet_id, params['max_id'])
+            metrics.inc("search_truncated_total")
+
+        return sorted({tweet['id']: tweet for tweet in tweets}.values(), key=lambda tweet: tweet['id'])
 
-        limit_reset = twitter.get_lastfunction_header('X-Rate-Limit-Reset', None)
+    def update_rate_limit(self):
+        self.set_rate_limit(last_header('X-Rate-Limit-Remaining'), last_header('X-Rate-Limit-Reset'))
+
+    def set_rate_limit(self, limit_remaining, limit_reset):
+        if limit_remaining is not None:
+            self.rate_limit_remaining = int(limit_remaining)
 
         if limit_reset is not None:
             self.rate_limit_reset = pendulum.from_timestamp(int(limit_reset))
 
-        self.save(update_fields=['rate_limit_remaining', 'rate_limit_reset', 'last_update'])
+    def update_converted_tweets(self):
+        tweets = list(self.tweet_set.all())
 
-        return tweets
+        for tweet in tweets:
+            tweet.converted_content = convert_content(tweet.content, self.mode)
+
+        Tweet.objects.bulk_update(tweets, ['converted_content'])
 
     def check_text_pattern(self, text):
         if self.mode == TwitterUser.MODE_INSTANT:
@@ -105,94 +307,122 @@ class Tweet(models.Model):
     user = models.ForeignKey('TwitterUser', on_delete=models.CASCADE)
     submitted_at = models.DateTimeField(auto_now_add=True, db_index=True)
     content = models.TextField()
+    converted_content = models.TextField(blank=True, default='')
 
     @classmethod
     def from_raw_tweet(cls, user, raw_tweet):
+        built = cls.build_from_raw_tweet(user, raw_tweet)
+
+        if built is None:
+            return None
+
+        with transaction.atomic():
+            cls.save_built([built])
+
+        return built[0]
+
+    @classmethod
+    def build_from_raw_tweet(cls, user, raw_tweet):
+        # DB에는 쓰지 않고 트윗과 첨부파일 객체만 만든다. 미디어 파일은 이 단계에서 저장소에 저장된다.
         text = raw_tweet['text']
 
-        if user.check_text_pattern(text):
-            tweet, _ = Tweet.objects.get_or_create(id=raw_tweet['id'], defaults={'user': user, 'content': text})
-            tweet.attachment_set.all().delete()
+        if not user.check_text_pattern(text):
+            return None
 
-            for media in raw_tweet['extended_entities']['media']:
-                media_url = media['media_url']
+        tweet = Tweet(id=raw_tweet['id'], user=user)
 
-                media_ext = media_url.split('/')[-1].split('.')[-1]
+        attachments = []
 
-                text = text.replace(f"{media['url']}", "").strip()
+        for media in raw_tweet.get('extended_entities', {}).get('media', []):
+            media_url = media['media_url']
 
-                if media['type'] == 'video':
-                    video_url = ""
+            media_ext = media_url.split('/')[-1].split('.')[-1]
 
-                    for variant in media['video_info']['variants']:
-                        if variant['content_type'] == 'video/mp4':
-                            video_url = variant['url']
-                            break
+            text = text.replace(f"{media['url']}", "").strip()
 
-                    attachment = Attachment(
-                        tweet=tweet,
-                        type=Attachment.VIDEO,
-                        ext=media_ext,
-                    )
+            if media['type'] == 'video':
+                video_url = ""
 
-                    attachment.thumbnail.save(f"{tweet.id}_{pendulum.now().timestamp()}_thumb.{media_ext}",
-                                              url_to_file(media_url))
-                    attachment.file.save(f"{tweet.id}_{pendulum.now().timestamp()}.mp4",
-                                         url_to_file(video_url))
+                for variant in media['video_info']['variants']:
+                    if variant['content_type'] == 'video/mp4':
+                        video_url = variant['url']
+                        break
 
-                    attachment.save()
+                attachment = Attachment(
+                    tweet=tweet,
+                    type=Attachment.VIDEO,
+                    ext=media_ext,
+                )
 
-                    break
-                elif media['type'] == 'photo':
-                    media_url += ':orig'
+                attachments.append((attachment, media_url, video_url, 'mp4'))
 
-                    attachment = Attachment(
-                        tweet=tweet,
-                        type=Attachment.PHOTO,
-                        ext=media_ext,
-                    )
-                    attachment.thumbnail.save(f"{tweet.id}_{pendulum.now().timestamp()}_thumb.{media_ext}",
-                                              url_to_file(media_url))
-                    attachment.file.save(f"{tweet.id}_{pendulum.now().timestamp()}.{media_ext}", url_to_file(media_url))
+                break
+            elif media['type'] == 'photo':
+                media_url += ':orig'
 
-                    attachment.save()
+                attachment = Attachment(
+                    tweet=tweet,
+                    type=Attachment.PHOTO,
+                    ext=media_ext,
+                )
 
-            tweet.content = text
-            tweet.save(update_fields=['content'])
+                # 사진은 원본을 한 번만 받아서 썸네일도 같은 파일에서 만든다.
+                attachments.append((attachment, media_url, media_url, media_ext))
 
-            return tweet
+        with fetch_all(url for attachment in attachments for url in attachment[1:3]) as files:
+            for attachment, thumbnail_url, file_url, file_ext in attachments:
+                # 저장소가 내용 해시로 이름을 정하므로 여기서는 확장자만 의미가 있다.
+                files[file_url].seek(0)
+                attachment.file.save(f"{tweet.id}.{file_ext}", files[file_url], save=False)
 
-        return None
+                # 썸네일은 비워두고 원본 이름만 남겨서 thumbnails.Renderer가 나중에 만들게 한다.
+                if thumbnail_url == file_url:
+                    attachment.thumbnail_source.name = attachment.file.name
+                else:
+                    files[thumbnail_url].seek(0)
+                    attachment.thumbnail_source.save(f"{tweet.id}_thumb.{attachment.ext}", files[thumbnail_url],
+                                                     save=False)
 
-    def get_converted_content(self):
-        text = self.content.strip()
+        tweet.content = text
+        tweet.converted_content = convert_content(text, user.mode)
 
-        if self.user.mode == TwitterUser.MODE_INSTANT:
-            text = re.sub(INSTANT_PATTERN, safe_convert, text)
-        else:
-            if text.startswith(ARCHIVE_TAG):
-                text = text[len(ARCHIVE_TAG):]
+        return tweet, [attachment for attachment, *_ in attachments]
 
-        return text
+    @classmethod
+    def save_built(cls, built):
+        # 트랜잭션 안에서 호출한다. 다시 들어온 트윗은 지우고 새로 넣는다.
+        tweets = [tweet for tweet, _ in built]
 
-    def post(self):
-        twitter = self.user.get_twitter_api()
+        existing = Tweet.objects.filter(id__in=[tweet.id for tweet in tweets])
+
+        if existing.exists():
+            existing.delete()
 
-        media_ids = []
+        Tweet.objects.bulk_create(tweets)
+        Attachment.objects.bulk_create([attachment for _, attachments in built for attachment in attachments])
 
-        for attachment in self.attachment_set.all():
-            if attachment.type == Attachment.VIDEO:
-                media_id = twitter.upload_video(open(attachment.file.path, "rb"), 'video/mp4')['media_id']
-            else:
-                media_id = twitter.upload_media(media=open(attachment.file.path, "rb"))['media_id']
+        return tweets
+
+    def get_converted_content(self):
+        return convert_content(self.content, self.user.mode)
+
+    def update_converted_content(self):
+        self.converted_content = self.get_converted_content()
+
+    def post(self):
+        twitter = self.user.get_twitter_api()
 
-            media_ids.append(media_id)
+        media_ids = upload_all(twitter, [
+            (attachment.file.path, attachment.type == Attachment.VIDEO) for attachment in self.attachment_set.all()
+        ], f"media/upload:{self.user_id}")
 
-        twitter.update_status(status=self.get_converted_content(), media_ids=media_ids)
+        with metrics.timed("post"):
+            ratelimit.call(f"statuses/update:{self.user_id}", twitter.update_status,
+                           status=self.get_converted_content(), media_ids=media_ids)
 
     def destroy(self):
         twitter = self.user.get_twitter_api()
-        twitter.destroy_status(id=self.id)
+        ratelimit.call(f"statuses/destroy:{self.user_id}", twitter.destroy_status, id=self.id)
 
 
 class Attachment(models.Model):
@@ -207,5 +437,66 @@ class Attachment(models.Model):
     tweet = models.ForeignKey('Tweet', on_delete=models.CASCADE)
     type = models.CharField(max_length=5, choices=TYPE_CHOICES)
     ext = models.CharField(max_length=5)
-    thumbnail = ProcessedImageField(processors=[ResizeToFit(width=280)], format='JPEG', options={'quality': 60})
-    file = models.FileField()
+    thumbnail = ProcessedImageField(processors=[ResizeToFit(width=280)], format='JPEG', options={'quality': 60},
+                                    storage=media_storage, blank=True)
+    thumbnail_source = models.FileField(storage=media_storage, blank=True)
+    file = models.FileField(storage=media_storage)
+
+    @staticmethod
+    def media_references():
+        references = collections.Counter()
+
+        for names in Attachment.objects.values_list('thumbnail', 'thumbnail_source', 'file').iterator():
+            references.update(name for name in names if name)
+
+        return references
+
+
+class OutboxOperation(models.Model):
+    PUBLISH = "publish"
+    DESTROY = "destroy"
+    INGEST = "ingest"
+
+    KIND_CHOICES = (
+        (PUBLISH, "업로드"),
+        (DESTROY, "원본 삭제"),
+        (INGEST, "웹훅 수신"),
+    )
+
+    PENDING = "pending"
+    DONE = "done"
+    FAILED = "failed"
+
+    STATUS_CHOICES = (
+        (PENDING, "대기"),
+        (DONE, "완료"),
+        (FAILED, "실패"),
+    )
+
+    key = models.CharField(max_length=64, unique=True)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    user = models.ForeignKey('TwitterUser', on_delete=models.CASCADE)
+    tweet_id = models.BigIntegerField()
+    delete_tweet = models.BooleanField(default=False)
+    payload = models.TextField(blank=True, default='')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(db_index=True)
+    locked_by = models.CharField(max_length=255, null=True, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    claim_token = models.CharField(max_length=32, null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+
+@receiver(post_save, sender=TwitterUser)
+def count_created_user(sender, instance, created, **kwargs):
+    # 사용자 수는 매번 세지 않고 만들고 지울 때마다 더하고 뺀다. 어긋난 것은 stats.update_stats가 가끔 바로잡는다.
+    if created:
+        ServiceStats.objects.filter(pk=1).update(total_users=F('total_users') + 1)
+
+
+@receiver(post_delete, sender=TwitterUser)
+def count_deleted_user(sender, instance, **kwargs):
+    ServiceStats.objects.filter(pk=1).update(total_users=F('total_users') - 1)
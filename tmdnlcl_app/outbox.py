@@ -0,0 +1,183 @@
+import uuid
+import logging
+import threading
+
+import pendulum
+from django.db import connections, transaction
+from django.db.models import Q
+
+from tmdnlcl_app import db
+from tmdnlcl_app.models import BatchNode, OutboxOperation
+
+BATCH_SIZE = 20
+POLL_INTERVAL = 1
+LOCK_TTL = 300
+MAX_ATTEMPTS = 8
+RETRY_DELAY = 10
+DONE_TTL = 60 * 60 * 24
+
+logger = logging.getLogger(__name__)
+
+_wakeup = threading.Event()
+
+
+@db.writes
+def enqueue(kind, user, tweet_id, delete_tweet=False):
+    operation, _ = OutboxOperation.objects.get_or_create(key=f"{kind}:{tweet_id}", defaults={
+        'kind': kind,
+        'user': user,
+        'tweet_id': tweet_id,
+        'delete_tweet': delete_tweet,
+        'next_attempt_at': pendulum.now(),
+    })
+
+    _wakeup.set()
+
+    return operation
+
+
+@db.writes
+def enqueue_many(operations, payloads=None):
+    # operations: (kind, user, tweet_id, delete_tweet) 목록, payloads: 트윗 id별로 같이 저장할 내용
+    now = pendulum.now()
+    payloads = payloads or {}
+
+    OutboxOperation.objects.bulk_create([
+        OutboxOperation(key=f"{kind}:{tweet_id}", kind=kind, user=user, tweet_id=tweet_id,
+                        delete_tweet=delete_tweet, payload=payloads.get(tweet_id, ''), next_attempt_at=now)
+        for kind, user, tweet_id, delete_tweet in operations
+    ], ignore_conflicts=True)
+
+    _wakeup.set()
+
+
+def known(tweet_ids):
+    # 업로드나 원본 삭제가 이미 잡힌 트윗. 웹훅과 검색이 같은 트윗을 가져와도 한 번만 처리한다.
+    return set(OutboxOperation.objects.filter(tweet_id__in=tweet_ids,
+                                              kind__in=[OutboxOperation.PUBLISH, OutboxOperation.DESTROY])
+               .values_list('tweet_id', flat=True))
+
+
+def _claimable(now):
+    return Q(status=OutboxOperation.PENDING, next_attempt_at__lte=now) & \
+        (Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+
+
+@db.writes
+def claim(owner, limit=BATCH_SIZE):
+    # 가져갈 때마다 새 토큰을 붙인다. 같은 프로세스가 잠금 만료 뒤에 다시 가져가도 먼저 가져간 쪽은 토큰이 달라서 실행하지 못한다.
+    now = pendulum.now()
+    token = uuid.uuid4().hex
+
+    with transaction.atomic():
+        candidates = list(
+            OutboxOperation.objects.select_for_update(skip_locked=True)
+            .filter(_claimable(now))
+            .order_by('next_attempt_at')
+            .values_list('id', flat=True)[:limit]
+        )
+
+        OutboxOperation.objects.filter(_claimable(now), id__in=candidates) \
+            .update(locked_by=owner, locked_until=now.add(seconds=LOCK_TTL), claim_token=token)
+
+    return list(OutboxOperation.objects.select_related('user').filter(id__in=candidates, claim_token=token))
+
+
+@db.writes
+def renew(operation):
+    # 큐에서 오래 기다린 사이 잠금이 풀려 다른 곳에서 다시 가져갔다면 실행하지 않는다.
+    return OutboxOperation.objects.filter(id=operation.id, claim_token=operation.claim_token,
+                                          status=OutboxOperation.PENDING) \
+        .update(locked_until=pendulum.now().add(seconds=LOCK_TTL)) > 0
+
+
+@db.writes
+def complete(operation):
+    OutboxOperation.objects.filter(id=operation.id, claim_token=operation.claim_token) \
+        .update(status=OutboxOperation.DONE, locked_by=None, locked_until=None, claim_token=None)
+
+
+@db.writes
+def fail(operation, error):
+    attempts = operation.attempts + 1
+
+    OutboxOperation.objects.filter(id=operation.id, claim_token=operation.claim_token).update(
+        status=OutboxOperation.FAILED if attempts >= MAX_ATTEMPTS else OutboxOperation.PENDING,
+        attempts=attempts,
+        next_attempt_at=pendulum.now().add(seconds=RETRY_DELAY * 2 ** operation.attempts),
+        last_error=repr(error),
+        locked_by=None,
+        locked_until=None,
+        claim_token=None,
+    )
+
+
+@db.writes
+def give_up(kind, user, tweet_id, payload, error, attempts=MAX_ATTEMPTS):
+    # 아웃박스 밖에서 여러 번 실패한 일을 실패 상태로 남긴다. 관리자 화면에서 대기로 돌리면 다시 처리한다.
+    OutboxOperation.objects.get_or_create(key=f"{kind}:{tweet_id}", defaults={
+        'kind': kind,
+        'user': user,
+        'tweet_id': tweet_id,
+        'payload': payload,
+        'status': OutboxOperation.FAILED,
+        'attempts': attempts,
+        'next_attempt_at': pendulum.now(),
+        'last_error': repr(error),
+    })
+
+
+@db.writes
+def defer(operation, until):
+    # 호출 한도 때문에 못 한 것은 실패로 세지 않고 한도가 풀리는 시각에 다시 한다.
+    OutboxOperation.objects.filter(id=operation.id, claim_token=operation.claim_token).update(
+        next_attempt_at=until,
+        locked_by=None,
+        locked_until=None,
+        claim_token=None,
+    )
+
+
+@db.writes
+def recover():
+    # 죽은 프로세스가 잡고 있던 작업은 잠금 만료를 기다리지 않고 바로 풀어준다.
+    return OutboxOperation.objects.filter(status=OutboxOperation.PENDING, locked_by__isnull=False) \
+        .exclude(locked_by__in=BatchNode.objects.values('name')) \
+        .update(locked_by=None, locked_until=None, claim_token=None)
+
+
+@db.writes
+def purge_done():
+    return OutboxOperation.objects.filter(status=OutboxOperation.DONE,
+                                          updated_at__lt=pendulum.now().subtract(seconds=DONE_TTL)).delete()
+
+
+class Drainer(threading.Thread):
+    def __init__(self, owner, dispatch):
+        super().__init__(name="Outbox")
+        self.owner = owner
+        self.dispatch = dispatch
+        self.exit = threading.Event()
+
+    def run(self):
+        while not self.exit.is_set():
+            try:
+                db.recycle()
+                operations = claim(self.owner)
+            except Exception:
+                logger.exception("아웃박스 작업 가져오기 실패")
+                operations = []
+
+            for operation in operations:
+                self.dispatch(operation)
+
+            if len(operations) < BATCH_SIZE:
+                _wakeup.wait(POLL_INTERVAL)
+                _wakeup.clear()
+
+        connections.close_all()
+        logger.info("끝")
+
+    def stop(self):
+        self.exit.set()
+        self.join()
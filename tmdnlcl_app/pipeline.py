@@ -0,0 +1,350 @@
+import json
+import queue
+import logging
+import threading
+
+from django.db import connections, transaction
+from twython import TwythonError, TwythonAuthError
+
+from tmdnlcl_app import db, metrics, outbox, ratelimit, thumbnails
+from tmdnlcl_app.models import OutboxOperation, Tweet, TwitterUser, POLL_STATE_FIELDS
+
+QUEUE_SIZE = 100
+
+logger = logging.getLogger(__name__)
+
+
+class Stage:
+    def __init__(self, name, handler, threads=1, maxsize=QUEUE_SIZE):
+        self.name = name
+        self.handler = handler
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.exit = threading.Event()
+        self.workers = [threading.Thread(target=self.run, name=f"{name}-{i}") for i in range(threads)]
+        self.busy = 0
+        self.busy_lock = threading.Lock()
+
+        metrics.gauge("queue_depth", self.queue.qsize, stage=name)
+        metrics.gauge("stage_workers", lambda: len(self.workers), stage=name)
+        metrics.gauge("stage_busy_workers", lambda: self.busy, stage=name)
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def put(self, item):
+        # 큐가 가득 차면 앞 단계가 여기서 기다리게 된다.
+        self.queue.put(item)
+
+    def offer(self, item):
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except queue.Full:
+            return False
+
+    def run(self):
+        name = threading.current_thread().name
+
+        while not self.exit.is_set() or not self.queue.empty():
+            try:
+                item = self.queue.get(True, 1)
+            except queue.Empty:
+                continue
+
+            with self.busy_lock:
+                self.busy += 1
+
+            try:
+                db.recycle()
+
+                with metrics.timed(self.name.lower()):
+                    self.handler(name, item)
+            except Exception:
+                logger.exception("%s 단계 처리 실패", self.name)
+            finally:
+                with self.busy_lock:
+                    self.busy -= 1
+
+                self.queue.task_done()
+
+        connections.close_all()
+        logger.info("끝")
+
+    def stop(self):
+        self.queue.join()
+        self.exit.set()
+
+        for worker in self.workers:
+            worker.join()
+
+
+class Pipeline:
+    def __init__(self, scheduler, owner, ingest_threads=2, publish_threads=2, destroy_threads=1,
+                 queue_size=QUEUE_SIZE, thumbnail_processes=None):
+        self.scheduler = scheduler
+        self.owner = owner
+        self.ingest = Stage("Ingest", self.handle_ingest, ingest_threads, queue_size)
+        self.push = Stage("Push", self.handle_push, ingest_threads, queue_size)
+        self.publish = Stage("Publish", self.handle_publish, publish_threads, queue_size)
+        self.destroy = Stage("Destroy", self.handle_destroy, destroy_threads, queue_size)
+        self.thumbnail = Stage("Thumbnail", self.handle_thumbnail, 1, queue_size)
+        self.drainer = outbox.Drainer(owner, self.dispatch)
+        self.renderer = thumbnails.Renderer(thumbnail_processes)
+        self.rendering = set()
+        self.rendering_lock = threading.Lock()
+        self.ingest_failures = {}
+
+    def start(self):
+        outbox.recover()
+
+        for stage in [self.ingest, self.push, self.publish, self.destroy, self.thumbnail]:
+            stage.start()
+
+        self.drainer.start()
+
+    def stop(self):
+        self.ingest.stop()
+        self.drainer.stop()
+        self.push.stop()
+        self.publish.stop()
+        self.destroy.stop()
+        self.thumbnail.stop()
+        self.renderer.shutdown()
+
+    def submit(self, user, raw_tweets):
+        metrics.inc("polls_total", found=bool(raw_tweets))
+
+        if raw_tweets:
+            self.ingest.put((user, raw_tweets))
+        else:
+            with metrics.timed("db_write"):
+                db.write(user.save, update_fields=POLL_STATE_FIELDS)
+
+            self.done(user, False)
+
+    def dispatch(self, operation):
+        if operation.kind == OutboxOperation.PUBLISH:
+            self.publish.put(operation)
+        elif operation.kind == OutboxOperation.INGEST:
+            self.push.put(operation)
+        else:
+            self.destroy.put(operation)
+
+    def done(self, user, found):
+        self.scheduler.done(user.id, found, user.rate_limit_remaining, user.rate_limit_reset)
+
+    def render_thumbnails(self, attachment_ids):
+        # 큐가 가득 차면 넘기지 않고, 남은 것은 다음 sweep_thumbnails가 DB에서 다시 찾아 넣는다.
+        with self.rendering_lock:
+            attachment_ids = [attachment_id for attachment_id in attachment_ids if attachment_id not in self.rendering]
+
+            for i in range(0, len(attachment_ids), thumbnails.BATCH_SIZE):
+                batch = attachment_ids[i:i + thumbnails.BATCH_SIZE]
+
+                if not self.thumbnail.offer(batch):
+                    break
+
+                self.rendering.update(batch)
+
+    def sweep_thumbnails(self):
+        self.render_thumbnails(list(
+            thumbnails.pending(self.owner).order_by('id').values_list('id', flat=True)[:thumbnails.BATCH_SIZE * 10]
+        ))
+
+    def remove_user(self, name, user):
+        logger.info("%s 사용자 삭제됨", user.id)
+        db.write(user.delete)
+        self.scheduler.remove(user.id)
+
+    def save_built(self, user, built):
+        # 트랜잭션 안에서 호출한다.
+        operations = []
+
+        for tweet, _ in built:
+            logger.info("%s-%s 트윗 발견", user.id, tweet.id)
+
+            if user.mode == TwitterUser.MODE_INSTANT:
+                operations.append((OutboxOperation.PUBLISH, user, tweet.id, False))
+            else:
+                logger.info("%s-%s 트윗 저장함", user.id, tweet.id)
+                operations.append((OutboxOperation.DESTROY, user, tweet.id, False))
+
+        Tweet.save_built(built)
+        outbox.enqueue_many(operations)
+
+    def built_saved(self, built):
+        metrics.inc("tweets_ingested_total", len(built))
+
+        if built:
+            self.render_thumbnails(list(
+                thumbnails.pending().filter(tweet_id__in=[tweet.id for tweet, _ in built])
+                .values_list('id', flat=True)
+            ))
+
+    def save_poll(self, user, built, last_tweet_id):
+        # 한 번의 탐색 결과는 트윗, 첨부파일, 아웃박스, 사용자 상태까지 한 트랜잭션으로 저장한다.
+        with transaction.atomic():
+            if built:
+                self.save_built(user, built)
+
+            user.last_tweet_id = last_tweet_id
+            user.save(update_fields=POLL_STATE_FIELDS)
+
+    def save_push(self, operation, built):
+        with transaction.atomic():
+            if built:
+                self.save_built(operation.user, built)
+
+            outbox.complete(operation)
+
+    def handle_ingest(self, name, item):
+        user, raw_tweets = item
+
+        built = []
+        last_tweet_id = user.last_tweet_id
+
+        try:
+            # 웹훅으로 이미 들어온 트윗은 미디어를 다시 받지 않는다.
+            known = outbox.known([raw_tweet['id'] for raw_tweet in raw_tweets])
+
+            # 오래된 트윗부터 미디어를 받아두고, 실패하면 그 앞까지만 저장해서 다음 탐색이 실패한 트윗부터 다시 시작하게 한다.
+            for raw_tweet in raw_tweets:
+                if raw_tweet['id'] not in known:
+                    try:
+                        result = Tweet.build_from_raw_tweet(user, raw_tweet)
+                    except Exception as e:
+                        logger.exception("%s-%s 트윗 가져오기 실패", user.id, raw_tweet['id'])
+
+                        if not self.ingest_failed(user, raw_tweet, e):
+                            break
+
+                        result = None
+
+                    if result is not None:
+                        built.append(result)
+
+                last_tweet_id = raw_tweet['id']
+            else:
+                self.ingest_failures.pop(user.id, None)
+
+            with metrics.timed("db_write"):
+                db.write(self.save_poll, user, built, last_tweet_id)
+
+            self.built_saved(built)
+        finally:
+            # 커서를 옮긴 뒤에야 다시 탐색하도록 해서 같은 트윗이 두 번 들어오지 않게 한다.
+            self.done(user, True)
+
+    def ingest_failed(self, user, raw_tweet, error):
+        # 같은 트윗이 계속 실패하면 커서가 영영 멈추므로 아웃박스처럼 MAX_ATTEMPTS번까지만 다시 해보고,
+        # 그 뒤에는 실패한 작업으로 남기고 건너뛴다. 건너뛰어도 되면 True를 돌려준다.
+        tweet_id, attempts = self.ingest_failures.get(user.id, (None, 0))
+        attempts = attempts + 1 if tweet_id == raw_tweet['id'] else 1
+
+        if attempts < outbox.MAX_ATTEMPTS:
+            self.ingest_failures[user.id] = (raw_tweet['id'], attempts)
+            return False
+
+        logger.error("%s-%s 트윗을 %s번 가져오지 못해서 건너뜀", user.id, raw_tweet['id'], attempts)
+        outbox.give_up(OutboxOperation.INGEST, user, raw_tweet['id'], json.dumps(raw_tweet), error, attempts)
+        self.ingest_failures.pop(user.id, None)
+
+        return True
+
+    def handle_push(self, name, operation):
+        # 웹훅으로 받은 트윗. 검색 커서(last_tweet_id)는 옮기지 않아서, 웹훅이 빠뜨린 트윗은 검색이 다시 찾는다.
+        if not outbox.renew(operation):
+            return
+
+        user = operation.user
+        built = []
+
+        try:
+            if operation.tweet_id not in outbox.known([operation.tweet_id]):
+                result = Tweet.build_from_raw_tweet(user, json.loads(operation.payload))
+
+                if result is not None:
+                    built.append(result)
+        except Exception as e:
+            logger.exception("%s-%s 트윗 가져오기 실패", user.id, operation.tweet_id)
+            outbox.fail(operation, e)
+            return
+
+        with metrics.timed("db_write"):
+            db.write(self.save_push, operation, built)
+
+        self.built_saved(built)
+
+    def handle_publish(self, name, operation):
+        if not outbox.renew(operation):
+            return
+
+        try:
+            tweet = Tweet.objects.select_related('user').get(id=operation.tweet_id)
+        except Tweet.DoesNotExist:
+            outbox.complete(operation)
+            return
+
+        logger.info("%s-%s 처리중", tweet.user_id, tweet.id)
+
+        try:
+            tweet.post()
+        except TwythonAuthError:
+            self.remove_user(name, operation.user)
+            return
+        except ratelimit.RateLimited as e:
+            logger.info("%s-%s 호출 한도 때문에 %s에 다시 업로드", tweet.user_id, tweet.id, e.reset_at)
+            outbox.defer(operation, e.reset_at)
+            return
+        except Exception as e:
+            logger.exception("%s-%s 업로드 실패", tweet.user_id, tweet.id)
+            outbox.fail(operation, e)
+            return
+
+        metrics.inc("tweets_posted_total")
+
+        db.write(self.published, operation)
+
+    def published(self, operation):
+        with transaction.atomic():
+            outbox.complete(operation)
+            outbox.enqueue(OutboxOperation.DESTROY, operation.user, operation.tweet_id, delete_tweet=True)
+
+    def handle_destroy(self, name, operation):
+        if not outbox.renew(operation):
+            return
+
+        try:
+            Tweet(id=operation.tweet_id, user=operation.user).destroy()
+        except TwythonAuthError:
+            self.remove_user(name, operation.user)
+            return
+        except ratelimit.RateLimited as e:
+            logger.info("%s-%s 호출 한도 때문에 %s에 다시 삭제", operation.user_id, operation.tweet_id, e.reset_at)
+            outbox.defer(operation, e.reset_at)
+            return
+        except Exception as e:
+            # 이미 지워진 트윗이면 할 일을 다 한 것이다.
+            if not isinstance(e, TwythonError) or e.error_code != 404:
+                logger.exception("%s-%s 원본 삭제 실패", operation.user_id, operation.tweet_id)
+                outbox.fail(operation, e)
+                return
+
+        db.write(self.destroyed, operation)
+
+    def destroyed(self, operation):
+        with transaction.atomic():
+            if operation.delete_tweet:
+                Tweet.objects.filter(id=operation.tweet_id).delete()
+
+            outbox.complete(operation)
+
+    def handle_thumbnail(self, name, attachment_ids):
+        try:
+            rendered = self.renderer.render_many(attachment_ids)
+            metrics.inc("thumbnails_rendered_total", rendered)
+            logger.info("썸네일 %s개 만듦", rendered)
+        finally:
+            with self.rendering_lock:
+                self.rendering.difference_update(attachment_ids)
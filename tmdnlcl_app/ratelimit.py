@@ -0,0 +1,91 @@
+import logging
+
+import pendulum
+from django.db.models import F
+from twython import TwythonRateLimitError
+
+from tmdnlcl_app import db, models
+from tmdnlcl_app.twitter import last_header
+
+DEFAULT_WINDOW = 15 * 60
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimited(Exception):
+    def __init__(self, key, reset_at):
+        super().__init__(f"{key} is rate limited until {reset_at}")
+        self.key = key
+        self.reset_at = reset_at
+
+
+def acquire(key):
+    # 한도를 다 쓴 버킷은 기다리지 않고 RateLimited를 낸다. 창이 끝날 때까지 자고 있으면 웹 요청이나 아웃박스 잠금을
+    # 오래 붙잡게 되므로, 언제 다시 할지는 부르는 쪽이 reset_at을 보고 정한다.
+    while True:
+        now = pendulum.now()
+
+        available = models.RateLimit.objects.filter(key=key, remaining__gt=0, reset_at__gt=now)
+
+        if db.write(available.update, remaining=F('remaining') - 1):
+            return
+
+        bucket = models.RateLimit.objects.filter(key=key).values_list('remaining', 'reset_at').first()
+
+        if bucket is None:
+            return
+
+        remaining, reset_at = bucket
+
+        if remaining is None or reset_at is None or reset_at <= now:
+            return
+
+        if remaining > 0:
+            continue
+
+        raise RateLimited(key, reset_at)
+
+
+def update(key, remaining, reset):
+    if remaining is None or reset is None:
+        return
+
+    db.write(models.RateLimit.objects.update_or_create, key=key, defaults={
+        'remaining': int(remaining),
+        'reset_at': pendulum.from_timestamp(int(reset)),
+    })
+
+
+def exhaust(key, reset=None):
+    reset_at = pendulum.from_timestamp(int(reset)) if reset is not None else pendulum.now().add(seconds=DEFAULT_WINDOW)
+
+    db.write(models.RateLimit.objects.update_or_create, key=key, defaults={'remaining': 0, 'reset_at': reset_at})
+
+    return reset_at
+
+
+def call(key, func, *args, **kwargs):
+    acquire(key)
+
+    try:
+        result = func(*args, **kwargs)
+    except TwythonRateLimitError as e:
+        exhaust(key, e.retry_after)
+        raise
+
+    # 요청은 이미 나갔으므로 기록에 실패해도 호출은 성공으로 돌려준다. 실패로 돌리면 같은 트윗을 다시 올리게 된다.
+    try:
+        update(key, last_header('X-Rate-Limit-Remaining'), last_header('X-Rate-Limit-Reset'))
+    except Exception:
+        logger.exception("%s 호출 한도 기록 실패", key)
+
+    return result
+
+
+def headroom():
+    # 아직 창이 끝나지 않은 버킷의 남은 호출 수. 키에 사용자 ID가 붙어 있어서 자격 증명별로 나뉜다.
+    return [
+        ({'key': key}, remaining)
+        for key, remaining in models.RateLimit.objects.filter(reset_at__gt=pendulum.now(), remaining__isnull=False)
+        .values_list('key', 'remaining')
+    ]
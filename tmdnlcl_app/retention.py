@@ -0,0 +1,60 @@
+import time
+
+import pendulum
+
+from tmdnlcl_app.models import AppSetting, Attachment, OutboxOperation, Tweet, media_storage
+from tmdnlcl_app.storage import GC_GRACE_PERIOD
+
+CHUNK_SIZE = 500
+
+
+def expired_tweet_ids(cutoff, chunk_size=CHUNK_SIZE):
+    # submitted_at 인덱스 순서대로 오래된 것부터 가져온다. 아직 처리할 아웃박스 작업이 남은 트윗은 건드리지 않는다.
+    pending = OutboxOperation.objects.filter(status=OutboxOperation.PENDING).values('tweet_id')
+
+    return list(
+        Tweet.objects.filter(submitted_at__lt=cutoff)
+        .exclude(id__in=pending)
+        .order_by('submitted_at')
+        .values_list('id', flat=True)[:chunk_size]
+    )
+
+
+def purge_chunk(cutoff, chunk_size=CHUNK_SIZE):
+    tweet_ids = expired_tweet_ids(cutoff, chunk_size)
+
+    if tweet_ids:
+        # 파일은 다른 첨부파일과 나눠 쓸 수 있으므로 여기서는 행만 지우고, 파일은 collect_media가 정리한다.
+        Tweet.objects.filter(id__in=tweet_ids).delete()
+
+    return len(tweet_ids)
+
+
+def collect_media(grace_period=GC_GRACE_PERIOD, verify=False):
+    return media_storage.collect_garbage(Attachment.media_references(), grace_period, verify)
+
+
+def purge(days=None, chunk_size=CHUNK_SIZE):
+    if days is None:
+        days = AppSetting.get_solo().retention_days
+
+    cutoff = pendulum.now().subtract(days=days)
+
+    started = time.monotonic()
+    tweets = 0
+
+    while True:
+        deleted = purge_chunk(cutoff, chunk_size)
+
+        tweets += deleted
+
+        if deleted < chunk_size:
+            break
+
+    elapsed = time.monotonic() - started
+
+    return {
+        'tweets': tweets,
+        'elapsed': elapsed,
+        'tweets_per_sec': tweets / elapsed if elapsed > 0 else 0,
+    }
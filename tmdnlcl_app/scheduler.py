@@ -0,0 +1,131 @@
+import heapq
+import threading
+import time
+
+MAX_BACKOFF = 60
+
+
+class Scheduler:
+    def __init__(self, delay, max_backoff=MAX_BACKOFF):
+        self.delay = delay
+        self.max_backoff = max(max_backoff, delay)
+        self.condition = threading.Condition()
+        self.heap = []
+        self.due = {}
+        self.backoff = {}
+        self.running = set()
+
+    def __len__(self):
+        with self.condition:
+            return len(self.due) + len(self.running)
+
+    def _push(self, user_id, due):
+        self.due[user_id] = due
+        heapq.heappush(self.heap, (due, user_id))
+        self.condition.notify()
+
+    def sync(self, users):
+        # users: (user_id, last_update, rate_limit_remaining, rate_limit_reset)
+        with self.condition:
+            user_ids = set()
+
+            for user_id, last_update, rate_limit_remaining, rate_limit_reset in users:
+                user_ids.add(user_id)
+
+                if user_id in self.due or user_id in self.running:
+                    continue
+
+                due = last_update.timestamp() + self.delay if last_update is not None else 0
+
+                if rate_limit_remaining == 0 and rate_limit_reset is not None:
+                    due = max(due, rate_limit_reset.timestamp())
+
+                self._push(user_id, due)
+
+            for user_id in set(self.due) - user_ids:
+                self.remove(user_id)
+
+            self.running &= user_ids
+
+    def remove(self, user_id):
+        with self.condition:
+            self.due.pop(user_id, None)
+            self.backoff.pop(user_id, None)
+            self.running.discard(user_id)
+
+    def get(self, timeout=None):
+        deadline = time.monotonic() + timeout if timeout is not None else None
+
+        with self.condition:
+            while True:
+                while self.heap and self.due.get(self.heap[0][1]) != self.heap[0][0]:
+                    heapq.heappop(self.heap)
+
+                now = time.time()
+
+                if self.heap and self.heap[0][0] <= now:
+                    _, user_id = heapq.heappop(self.heap)
+                    del self.due[user_id]
+                    self.running.add(user_id)
+                    return user_id
+
+                wait = self.heap[0][0] - now if self.heap else None
+
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+
+                    if remaining <= 0:
+                        return None
+
+                    wait = remaining if wait is None else min(wait, remaining)
+
+                self.condition.wait(wait)
+
+    def get_many(self, count, timeout=None):
+        user_id = self.get(timeout)
+
+        if user_id is None:
+            return []
+
+        user_ids = [user_id]
+
+        with self.condition:
+            now = time.time()
+
+            while len(user_ids) < count and self.heap and self.heap[0][0] <= now:
+                due, user_id = heapq.heappop(self.heap)
+
+                if self.due.get(user_id) != due:
+                    continue
+
+                del self.due[user_id]
+                self.running.add(user_id)
+                user_ids.append(user_id)
+
+        return user_ids
+
+    def done(self, user_id, found, rate_limit_remaining=None, rate_limit_reset=None):
+        with self.condition:
+            if user_id not in self.running:
+                return
+
+            self.running.discard(user_id)
+
+            if found:
+                interval = self.delay
+            else:
+                interval = min(self.max_backoff, max(self.delay, self.backoff.get(user_id, 0) * 2))
+
+            self.backoff[user_id] = interval
+
+            now = time.time()
+            due = now + interval
+
+            if rate_limit_remaining is not None and rate_limit_reset is not None:
+                if rate_limit_remaining == 0:
+                    due = max(due, rate_limit_reset.timestamp())
+                else:
+                    # 남은 호출을 창이 끝날 때까지 고르게 나눠 써서 429를 맞기 전에 스스로 늦춘다.
+                    due = max(due, now + (rate_limit_reset.timestamp() - now) / rate_limit_remaining)
+
+            self._push(user_id, due)
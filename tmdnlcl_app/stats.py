@@ -0,0 +1,35 @@
+from django.core.cache import cache
+from django.db.models import Count, Max
+
+from tmdnlcl_app.models import ServiceStats, TwitterUser
+
+STATS_CACHE_KEY = 'tmdnlcl_app:stats'
+STATS_TTL = 60
+
+
+def get_stats():
+    stats = cache.get(STATS_CACHE_KEY)
+
+    if stats is None:
+        stats = ServiceStats.objects.filter(pk=1).values('total_users', 'last_update').first()
+
+        if stats is None:
+            stats = update_stats()
+
+        cache.set(STATS_CACHE_KEY, stats, STATS_TTL)
+
+    return stats
+
+
+def update_stats():
+    # 전체를 다시 세므로 가끔 도는 정리 작업(tmdnlcl_purge)에서만 부른다. 평소에는 models의 시그널이 사용자 수를 맞춘다.
+    stats = TwitterUser.objects.aggregate(total_users=Count('id'), last_update=Max('last_update'))
+    ServiceStats.objects.update_or_create(pk=1, defaults=stats)
+
+    return stats
+
+
+def update_last_update():
+    # last_update에는 인덱스가 있어서 가장 최근 값 하나만 읽는다.
+    last_update = TwitterUser.objects.aggregate(last_update=Max('last_update'))['last_update']
+    ServiceStats.objects.filter(pk=1).update(last_update=last_update)
@@ -0,0 +1,115 @@
+import os
+import re
+import time
+import hashlib
+import tempfile
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASH_CHUNK_SIZE = 64 * 1024
+GC_GRACE_PERIOD = 60 * 60
+
+BLOB_PATTERN = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$")
+
+
+def hash_file(content):
+    digest = hashlib.sha256()
+
+    content.seek(0)
+
+    for chunk in iter(lambda: content.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+
+    content.seek(0)
+
+    return digest.hexdigest()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    # 파일 이름 대신 내용의 sha256으로 저장한다. 같은 내용은 한 번만 디스크에 쓰고, 여러 첨부파일이 같은 파일을 가리킨다.
+
+    def blob_name(self, digest, ext):
+        return f"{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+    def generate_filename(self, filename):
+        return filename
+
+    def save(self, name, content, max_length=None):
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        _, ext = os.path.splitext(name)
+        name = self.blob_name(hash_file(content), ext.lower())
+
+        return self._save(name, content)
+
+    def _save(self, name, content):
+        path = self.path(name)
+
+        if os.path.exists(path):
+            if os.path.getsize(path) == content.size:
+                # 이미 있는 내용이면 쓰지 않고, 가비지 컬렉션 유예 시간만 새로 시작한다.
+                os.utime(path)
+                return name
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        # 같은 내용을 동시에 저장해도 임시 파일을 원자적으로 옮기므로 반쯤 쓰인 파일이 보이지 않는다.
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in content.chunks():
+                    f.write(chunk)
+
+            if self.file_permissions_mode is not None:
+                os.chmod(temp_path, self.file_permissions_mode)
+
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        return name
+
+    def verify(self, name):
+        with self.open(name) as f:
+            return hash_file(f) == os.path.splitext(os.path.basename(name))[0]
+
+    def files(self):
+        for root, _, files in os.walk(self.location):
+            for filename in files:
+                yield os.path.relpath(os.path.join(root, filename), self.location).replace(os.sep, '/')
+
+    def collect_garbage(self, references, grace_period=GC_GRACE_PERIOD, verify=False):
+        # references: 이름별 참조 수. 참조가 없고 유예 시간이 지난 파일만 지운다.
+        # 해시 이름이 아닌 예전 {tweet_id}_{timestamp}.ext 파일이나 중간에 죽어서 남은 임시 파일도 같이 정리한다.
+        now = time.time()
+        stats = {'files': 0, 'deleted': 0, 'freed': 0, 'corrupted': []}
+
+        for name in list(self.files()):
+            stats['files'] += 1
+            path = self.path(name)
+
+            if not references.get(name):
+                try:
+                    stat = os.stat(path)
+
+                    if now - stat.st_mtime < grace_period:
+                        continue
+
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+
+                stats['deleted'] += 1
+                stats['freed'] += stat.st_size
+            elif verify and BLOB_PATTERN.match(name) and not self.verify(name):
+                stats['corrupted'].append(name)
+
+        return stats
@@ -1,3 +1,420 @@
-from django.test import TestCase
+import os
+import json
+import tempfile
+from unittest import mock
+from concurrent.futures.process import BrokenProcessPool
 
-# Create your tests here.
+import pendulum
+from django.test import TestCase, override_settings
+from django.core.cache import cache
+from django.urls import reverse
+
+from PIL import Image
+from twython import Twython
+
+from tmdnlcl_app import hangul, media, outbox, stats, thumbnails, webhooks
+from tmdnlcl_app.pipeline import Pipeline
+from tmdnlcl_app.fake_twitter import FakeTwitter, RedirectAdapter
+from tmdnlcl_app.models import AppSetting, BatchNode, RateLimit, ServiceStats, TwitterUser, Tweet, Attachment, \
+    OutboxOperation, SEARCH_PAGE_SIZE, SEARCH_MAX_PAGES
+from tmdnlcl_app.views import TWEETS_PER_PAGE
+
+
+class IndexQueryCountTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+        self.user = TwitterUser.objects.create(id=1, oauth_token='token', oauth_token_secret='secret')
+
+        session = self.client.session
+        session['user_id'] = self.user.id
+        session['screen_name'] = 'tmdnlcl'
+        session.save()
+
+    def create_tweets(self, count):
+        for tweet_id in range(Tweet.objects.count(), Tweet.objects.count() + count):
+            tweet = Tweet.objects.create(id=tweet_id, user=self.user, content='// test', converted_content=' test')
+
+            for _ in range(2):
+                Attachment.objects.create(tweet=tweet, type=Attachment.PHOTO, ext='jpg',
+                                          thumbnail=f'{tweet_id}_thumb.jpg', file=f'{tweet_id}.jpg')
+
+    def assertIndexQueries(self, num):
+        with self.assertNumQueries(num):
+            response = self.client.get(reverse('index'))
+
+        self.assertEqual(response.status_code, 200)
+
+        return response
+
+    def test_constant_queries(self):
+        self.create_tweets(1)
+        self.client.get(reverse('index'))
+
+        # session, user, count, tweets + user, attachments
+        self.assertIndexQueries(5)
+
+        self.create_tweets(30)
+        response = self.assertIndexQueries(5)
+
+        self.assertContains(response, '<div class="card mb-4">', count=TWEETS_PER_PAGE)
+
+
+class HangulTest(TestCase):
+    # heconvert.converter.e2h가 내던 결과
+    CONVERSIONS = {
+        'dkssudgktpdy': '안녕하세요',
+        # 쌍자음
+        'RkRkdmf': '까까을',
+        'Tkdrjfdl': '쌍걸이',
+        'QnfQnf': '뿔뿔',
+        'dlTek': '있다',
+        # 겹받침
+        'ekfr': '닭',
+        'rkqt': '값',
+        'qkfqdk': '밟아',
+        'dksgdk': '않아',
+        # 겹모음
+        'ghkdlxld': '화이팅',
+        'dhoqhkd': '왜봥',
+        'dnjsgkek': '원하다',
+        'dnpdj': '웨어',
+        'dnlgj': '위허',
+        'dmlwk': '의자',
+        # 한글 키가 아닌 글자는 그대로 둔다.
+        'gksrmf123 abc!': '한글123 뮻!',
+        '@tmdnlcl 짱': '@스위치 짱',
+        'Wkwkda': '짜장ㅁ',
+        '': '',
+    }
+
+    def test_matches_heconvert(self):
+        for text, expected in self.CONVERSIONS.items():
+            self.assertEqual(hangul.e2h(text), expected, text)
+
+    def test_differs_from_heconvert(self):
+        # 일부러 heconvert와 다르게 한 것: 자음이 이어지면 보통 입력기처럼 조합하고, 단어가 바뀌면 받침을 넘기지 않는다.
+        self.assertEqual(hangul.e2h('wzh'), 'ㅈ코')
+        self.assertEqual(hangul.e2h('ekfr dkfk'), '닭 아라')
+
+
+class FakeSearch:
+    def __init__(self, count):
+        # 두 사용자가 번갈아 쓴 트윗
+        self.tweets = [{'id': tweet_id, 'user': {'id': 2 - tweet_id % 2}} for tweet_id in range(count, 0, -1)]
+        self.calls = 0
+
+    def search(self, since_id=0, max_id=None, count=SEARCH_PAGE_SIZE, **params):
+        self.calls += 1
+        statuses = [tweet for tweet in self.tweets if since_id < tweet['id'] <= (max_id or tweet['id'])]
+
+        return {'statuses': statuses[:count]}
+
+
+class SearchManyTest(TestCase):
+    def setUp(self):
+        self.users = [TwitterUser(id=user_id, screen_name=f'user{user_id}') for user_id in (1, 2)]
+
+    def test_group_search(self):
+        twitter = FakeSearch(100)
+        self.users[0].last_tweet_id, self.users[1].last_tweet_id = 90, 50
+
+        results = TwitterUser._search_tweets_many(twitter, self.users, '#test')
+
+        self.assertEqual([tweet['id'] for tweet in results[1]], [91, 93, 95, 97, 99])
+        self.assertEqual(len(results[2]), 25)
+        self.assertEqual(twitter.calls, 1)
+
+    def test_stale_cursor_left_to_user_search(self):
+        count = SEARCH_PAGE_SIZE * SEARCH_MAX_PAGES + 50
+        twitter = FakeSearch(count)
+        self.users[0].last_tweet_id, self.users[1].last_tweet_id = count - 10, 10
+
+        results = TwitterUser._search_tweets_many(twitter, self.users, '#test')
+
+        # 페이지 한도에 걸려서 잘린 트윗이 있으므로 커서가 뒤처진 사용자는 결과에서 빠진다.
+        self.assertEqual(twitter.calls, SEARCH_MAX_PAGES)
+        self.assertEqual(list(results), [1])
+        self.assertEqual(len(results[1]), 5)
+
+    def test_user_search_warns_when_truncated(self):
+        user = self.users[1]
+        user.last_tweet_id = 10
+
+        with mock.patch.object(TwitterUser, 'get_twitter_api', return_value=FakeSearch(SEARCH_PAGE_SIZE * 20)), \
+                self.assertLogs('tmdnlcl_app.models', 'WARNING'):
+            tweets = user._search_tweets('#test', 'user2')
+
+        self.assertEqual(len(tweets), SEARCH_PAGE_SIZE * SEARCH_MAX_PAGES)
+
+
+class UploadVideoTest(TestCase):
+    def setUp(self):
+        self.fake = FakeTwitter()
+        self.fake.start()
+
+        self.twitter = Twython('key', 'secret', 'token', 'secret')
+        self.twitter.client.mount('https://', RedirectAdapter(self.fake.base_url))
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def test_chunked_upload(self):
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(b'v' * (media.UPLOAD_CHUNK_SIZE + 1000))
+            f.flush()
+
+            media_id = media.upload_video(self.twitter, f.name)
+
+        self.assertEqual(self.fake.uploads[media_id]['segments'], {0: media.UPLOAD_CHUNK_SIZE, 1: 1000})
+
+
+class OutboxTest(TestCase):
+    def setUp(self):
+        self.user = TwitterUser.objects.create(id=1, oauth_token='token', oauth_token_secret='secret')
+
+        for tweet_id in (10, 11):
+            outbox.enqueue(OutboxOperation.PUBLISH, self.user, tweet_id)
+
+    def expire_locks(self):
+        OutboxOperation.objects.update(locked_until=pendulum.now().subtract(seconds=1))
+
+    def test_claim_is_exclusive(self):
+        first = outbox.claim('a')
+
+        self.assertEqual(len(first), 2)
+        self.assertEqual(outbox.claim('b'), [])
+
+        # 잠금이 풀려 같은 프로세스가 다시 가져가면 먼저 가져간 것은 실행하지 못한다.
+        self.expire_locks()
+        second = outbox.claim('a')
+
+        self.assertEqual(len(second), 2)
+        self.assertFalse(any(outbox.renew(operation) for operation in first))
+        self.assertTrue(all(outbox.renew(operation) for operation in second))
+
+        outbox.complete(first[0])
+        self.assertFalse(OutboxOperation.objects.filter(status=OutboxOperation.DONE).exists())
+
+    def test_fail_backs_off_until_failed(self):
+        OutboxOperation.objects.filter(tweet_id=11).delete()
+
+        for attempt in range(outbox.MAX_ATTEMPTS):
+            operation, = outbox.claim('a')
+            outbox.fail(operation, RuntimeError("boom"))
+
+            operation.refresh_from_db()
+            delay = (operation.next_attempt_at - pendulum.now()).total_seconds()
+
+            self.assertEqual(operation.attempts, attempt + 1)
+            self.assertAlmostEqual(delay, outbox.RETRY_DELAY * 2 ** attempt, delta=5)
+            self.assertIsNone(operation.locked_by)
+
+            OutboxOperation.objects.update(next_attempt_at=pendulum.now())
+
+        self.assertEqual(operation.status, OutboxOperation.FAILED)
+        self.assertEqual(outbox.claim('a'), [])
+
+    def test_enqueue_many_skips_existing(self):
+        # bulk_create(ignore_conflicts=True)에 기대므로 Django 2.2 이상이 필요하다.
+        outbox.enqueue_many([(OutboxOperation.PUBLISH, self.user, tweet_id, False) for tweet_id in (10, 11, 12)])
+
+        self.assertEqual(sorted(OutboxOperation.objects.values_list('tweet_id', flat=True)), [10, 11, 12])
+
+    def test_defer_keeps_attempts(self):
+        reset_at = pendulum.now().add(minutes=10)
+
+        for operation in outbox.claim('a'):
+            outbox.defer(operation, reset_at)
+
+        self.assertEqual(outbox.claim('a'), [])
+        self.assertFalse(OutboxOperation.objects.exclude(attempts=0).exists())
+        self.assertFalse(OutboxOperation.objects.filter(locked_by__isnull=False).exists())
+
+    def test_recover_releases_dead_owners(self):
+        BatchNode.objects.create(name='alive', heartbeat_at=pendulum.now())
+
+        outbox.claim('alive', limit=1)
+        outbox.claim('dead', limit=1)
+
+        self.assertEqual(outbox.recover(), 1)
+        self.assertEqual(list(OutboxOperation.objects.filter(locked_by__isnull=False)
+                              .values_list('locked_by', flat=True)), ['alive'])
+        self.assertEqual(len(outbox.claim('b')), 1)
+
+
+class IngestTest(TestCase):
+    def setUp(self):
+        self.user = TwitterUser.objects.create(id=1, oauth_token='token', oauth_token_secret='secret', last_tweet_id=1)
+        self.pipeline = Pipeline(mock.Mock(), 'a', thumbnail_processes=1)
+        self.addCleanup(self.pipeline.renderer.shutdown)
+
+    def build(self, user, raw_tweet):
+        if raw_tweet['id'] == 10:
+            raise RuntimeError("boom")
+
+    def test_skip_after_max_attempts(self):
+        raw_tweets = [{'id': 10}, {'id': 11}]
+
+        with mock.patch.object(Tweet, 'build_from_raw_tweet', side_effect=self.build):
+            for _ in range(outbox.MAX_ATTEMPTS - 1):
+                self.pipeline.handle_ingest('Ingest-0', (self.user, raw_tweets))
+
+            self.assertEqual(TwitterUser.objects.get(id=1).last_tweet_id, 1)
+
+            self.pipeline.handle_ingest('Ingest-0', (self.user, raw_tweets))
+
+        self.assertEqual(TwitterUser.objects.get(id=1).last_tweet_id, 11)
+
+        operation = OutboxOperation.objects.get(kind=OutboxOperation.INGEST, tweet_id=10)
+
+        self.assertEqual(operation.status, OutboxOperation.FAILED)
+        self.assertEqual(json.loads(operation.payload), {'id': 10})
+        self.assertEqual(self.pipeline.ingest_failures, {})
+
+
+class PostViewTest(TestCase):
+    def setUp(self):
+        user = TwitterUser.objects.create(id=1, oauth_token='token', oauth_token_secret='secret')
+        Tweet.objects.create(id=10, user=user, content='// test', converted_content=' test')
+
+        session = self.client.session
+        session['user_id'] = user.id
+        session.save()
+
+    def test_rate_limited(self):
+        # 한도가 풀릴 때까지 기다리지 않고 바로 돌려보낸다.
+        RateLimit.objects.create(key='statuses/update:1', remaining=0, reset_at=pendulum.now().add(hours=1))
+
+        response = self.client.post(reverse('post'), {'tweet_id': 10, 'content': 'test'}, follow=True)
+
+        self.assertContains(response, "호출 한도")
+        self.assertTrue(Tweet.objects.filter(id=10).exists())
+
+
+class MediaTest(TestCase):
+    name = 'ab/cd/' + 'abcd' * 16 + '.jpg'
+
+    def setUp(self):
+        user = TwitterUser.objects.create(id=1, oauth_token='token', oauth_token_secret='secret')
+        tweet = Tweet.objects.create(id=1, user=user, content='// test', converted_content=' test')
+        Attachment.objects.create(tweet=tweet, type=Attachment.PHOTO, ext='jpg', file=self.name)
+
+    def get_media(self):
+        return self.client.get(reverse('media', args=[self.name]), HTTP_IF_NONE_MATCH='"' + 'abcd' * 16 + '"')
+
+    def test_not_modified_requires_owner(self):
+        self.assertEqual(self.get_media().status_code, 404)
+
+        session = self.client.session
+        session['user_id'] = 2
+        session.save()
+
+        self.assertEqual(self.get_media().status_code, 404)
+
+        session['user_id'] = 1
+        session.save()
+
+        response = self.get_media()
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], '"' + 'abcd' * 16 + '"')
+
+
+class ThumbnailTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+
+        settings = override_settings(MEDIA_ROOT=self.media_root.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        Image.new('RGB', (560, 100)).save(os.path.join(self.media_root.name, 'source.jpg'))
+
+        user = TwitterUser.objects.create(id=1, oauth_token='token', oauth_token_secret='secret')
+        tweet = Tweet.objects.create(id=1, user=user, content='// test', converted_content=' test')
+        self.attachment = Attachment.objects.create(tweet=tweet, type=Attachment.PHOTO, ext='jpg',
+                                                    file='source.jpg', thumbnail_source='source.jpg')
+
+        self.renderer = thumbnails.Renderer(1)
+        self.addCleanup(self.renderer.shutdown)
+
+    def test_restart_broken_pool(self):
+        with self.assertRaises(BrokenProcessPool):
+            self.renderer.executor.submit(os._exit, 1).result()
+
+        self.assertEqual(self.renderer.render_many([self.attachment.id]), 1)
+
+        self.attachment.refresh_from_db()
+        self.assertTrue(self.attachment.thumbnail.name)
+        self.assertEqual(self.attachment.thumbnail_source.name, '')
+
+
+class StatsTest(TestCase):
+    def total_users(self):
+        return ServiceStats.objects.get(pk=1).total_users
+
+    def test_counts_without_recompute(self):
+        TwitterUser.objects.create(id=1, oauth_token='token', oauth_token_secret='secret')
+        self.assertEqual(stats.update_stats()['total_users'], 1)
+
+        user = TwitterUser.objects.create(id=2, oauth_token='token', oauth_token_secret='secret')
+        self.assertEqual(self.total_users(), 2)
+
+        user.save()
+        self.assertEqual(self.total_users(), 2)
+
+        TwitterUser.objects.all().delete()
+        self.assertEqual(self.total_users(), 0)
+
+
+class WebhookTest(TestCase):
+    def setUp(self):
+        setting = AppSetting.get_solo()
+        setting.twitter_api_secret = 'secret'
+        setting.save()
+
+        self.user = TwitterUser.objects.create(id=1, oauth_token='token', oauth_token_secret='secret',
+                                               mode=TwitterUser.MODE_INSTANT)
+
+    def status(self, tweet_id, text, user_id=1):
+        return {'id': tweet_id, 'text': text, 'user': {'id': user_id}}
+
+    def post_event(self, event, secret='secret'):
+        body = json.dumps(event).encode()
+
+        return self.client.post(reverse('webhook'), body, content_type='application/json',
+                                HTTP_X_TWITTER_WEBHOOKS_SIGNATURE=webhooks.sign(secret, body))
+
+    def test_crc(self):
+        response = self.client.get(reverse('webhook'), {'crc_token': 'challenge'})
+
+        self.assertEqual(response.json(), webhooks.crc_response('secret', 'challenge'))
+
+    def test_bad_signature(self):
+        event = {'for_user_id': '1', 'tweet_create_events': [self.status(10, '&gt;hi&lt; #NintendoSwitch')]}
+
+        self.assertEqual(self.post_event(event, secret='wrong').status_code, 403)
+        self.assertFalse(OutboxOperation.objects.exists())
+
+    def test_accept_matching_statuses(self):
+        event = {'for_user_id': '1', 'tweet_create_events': [
+            self.status(10, '&gt;hi&lt; #NintendoSwitch'),
+            self.status(11, 'hi #NintendoSwitch'),
+            self.status(12, '&gt;hi&lt; #NintendoSwitch', user_id=2),
+        ]}
+
+        self.assertEqual(self.post_event(event).status_code, 200)
+        self.assertEqual(self.post_event(event).status_code, 200)
+
+        operation = OutboxOperation.objects.get()
+
+        self.assertEqual((operation.kind, operation.tweet_id), (OutboxOperation.INGEST, 10))
+        self.assertEqual(json.loads(operation.payload)['id'], 10)
+
+    def test_malformed_event(self):
+        for event in ([], {'for_user_id': None}, {'for_user_id': '1', 'tweet_create_events': [None]}):
+            self.assertEqual(self.post_event(event).status_code, 400)
+
+        self.assertFalse(OutboxOperation.objects.exists())
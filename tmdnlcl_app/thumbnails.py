@@ -0,0 +1,97 @@
+import io
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.core.files.base import ContentFile
+from PIL import Image
+
+from tmdnlcl_app import db
+from tmdnlcl_app.models import Attachment, media_storage
+
+THUMBNAIL_WIDTH = 280
+THUMBNAIL_QUALITY = 60
+BATCH_SIZE = 20
+
+logger = logging.getLogger(__name__)
+
+
+def render(path, width=THUMBNAIL_WIDTH, quality=THUMBNAIL_QUALITY):
+    # 별도 프로세스에서 실행되므로 Django나 DB에는 손대지 않고 JPEG 바이트만 돌려준다.
+    with Image.open(path) as image:
+        height = max(round(image.height * width / image.width), 1)
+
+        if image.format == 'JPEG':
+            # 원본 해상도 전체를 풀지 않고 썸네일 크기에 가까운 1/2~1/8 배율로 디코딩한다.
+            image.draft('RGB', (width, height))
+
+        thumbnail = image.convert('RGB').resize((width, height), Image.LANCZOS)
+
+    output = io.BytesIO()
+    thumbnail.save(output, 'JPEG', quality=quality)
+
+    return output.getvalue()
+
+
+def pending(owner=None):
+    attachments = Attachment.objects.filter(thumbnail='').exclude(thumbnail_source='')
+
+    if owner is not None:
+        attachments = attachments.filter(tweet__user__lease_owner=owner)
+
+    return attachments
+
+
+class Renderer:
+    def __init__(self, processes=None):
+        self.processes = processes
+        self.executor = ProcessPoolExecutor(max_workers=processes)
+
+    def render_many(self, attachment_ids):
+        attachments = list(pending().filter(id__in=attachment_ids))
+
+        paths = [media_storage.path(attachment.thumbnail_source.name) for attachment in attachments]
+
+        try:
+            futures = self.submit_all(paths)
+        except BrokenProcessPool:
+            # 풀이 이미 깨져 있었으면 새로 만들어서 한 번만 다시 넣는다.
+            logger.exception("썸네일 프로세스 풀 재시작")
+            self.restart()
+            futures = self.submit_all(paths)
+
+        rendered = 0
+
+        for attachment, future in zip(attachments, futures):
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                # 작업 프로세스가 죽으면 풀 전체를 다시 쓸 수 없으므로 새로 만들고,
+                # 묶음의 남은 것은 원본 표시가 그대로 있으니 다음 sweep이 다시 넣는다.
+                logger.exception("썸네일 프로세스 풀 재시작")
+                self.restart()
+                break
+            except Exception:
+                # 원본이 깨졌거나 없어진 것은 다시 해봐도 안 되므로 원본 표시를 지워서 다음 sweep에서 빼고,
+                # 같은 묶음의 나머지는 그대로 만든다.
+                logger.exception("%s 썸네일 만들기 실패", attachment.id)
+                db.write(Attachment.objects.filter(id=attachment.id, thumbnail='').update, thumbnail_source='')
+                continue
+
+            name = media_storage.save(f"{attachment.id}_thumb.jpg", ContentFile(result))
+
+            rendered += db.write(Attachment.objects.filter(id=attachment.id, thumbnail='').update,
+                                 thumbnail=name, thumbnail_source='')
+
+        return rendered
+
+    def submit_all(self, paths):
+        # 한 묶음을 여러 프로세스에 나눠서 동시에 만든다.
+        return [self.executor.submit(render, path) for path in paths]
+
+    def restart(self):
+        self.executor.shutdown(wait=False)
+        self.executor = ProcessPoolExecutor(max_workers=self.processes)
+
+    def shutdown(self):
+        self.executor.shutdown()
@@ -0,0 +1,105 @@
+import threading
+import collections
+
+from twython import Twython
+
+CLIENT_CACHE_SIZE = 1024
+
+_clients = collections.OrderedDict()
+_clients_lock = threading.Lock()
+_transport = None
+_responses = threading.local()
+
+
+def set_transport(adapter):
+    # 벤치마크처럼 요청을 다른 서버로 돌려야 할 때 모든 클라이언트에 이 어댑터를 붙인다.
+    global _transport
+
+    with _clients_lock:
+        _transport = adapter
+
+        for twitter in _clients.values():
+            _mount(twitter)
+
+
+def _mount(twitter):
+    if _transport is not None:
+        twitter.client.mount('https://', _transport)
+        twitter.client.mount('http://', _transport)
+
+    return twitter
+
+
+def _remember_response(response, *args, **kwargs):
+    _responses.last = response
+
+
+def last_header(name, default=None):
+    # Twython은 마지막 응답을 인스턴스에 하나만 두므로 여러 스레드가 같은 클라이언트를 쓰면 다른 요청의 헤더를 읽게 된다.
+    # 응답 훅으로 스레드마다 따로 기억해 두고, 방금 이 스레드에서 보낸 요청의 헤더를 읽는다.
+    response = getattr(_responses, 'last', None)
+
+    if response is None:
+        return default
+
+    return response.headers.get(name, default)
+
+
+def _new_client(*args, **kwargs):
+    twitter = Twython(*args, **kwargs)
+    twitter.client.hooks['response'].append(_remember_response)
+
+    return _mount(twitter)
+
+
+def _get_or_create(key, factory):
+    with _clients_lock:
+        twitter = _clients.get(key)
+
+        if twitter is not None:
+            _clients.move_to_end(key)
+            return twitter
+
+    twitter = factory()
+
+    with _clients_lock:
+        twitter = _clients.setdefault(key, twitter)
+        _clients.move_to_end(key)
+
+        while len(_clients) > CLIENT_CACHE_SIZE:
+            _, evicted = _clients.popitem(last=False)
+            evicted.client.close()
+
+    return twitter
+
+
+def _discard(key):
+    with _clients_lock:
+        twitter = _clients.pop(key, None)
+
+    if twitter is not None:
+        twitter.client.close()
+
+
+def get_client(app_key, app_secret, oauth_token=None, oauth_token_secret=None):
+    return _get_or_create(
+        (app_key, app_secret, oauth_token, oauth_token_secret),
+        lambda: _new_client(app_key, app_secret, oauth_token, oauth_token_secret)
+    )
+
+
+def discard_client(app_key, app_secret, oauth_token=None, oauth_token_secret=None):
+    _discard((app_key, app_secret, oauth_token, oauth_token_secret))
+
+
+def _create_app_client(app_key, app_secret):
+    access_token = _new_client(app_key, app_secret, oauth_version=2).obtain_access_token()
+    return _new_client(app_key, access_token=access_token)
+
+
+def get_app_client(app_key, app_secret):
+    return _get_or_create(('oauth2', app_key, app_secret), lambda: _create_app_client(app_key, app_secret))
+
+
+def discard_app_client(app_key, app_secret):
+    _discard(('oauth2', app_key, app_secret))
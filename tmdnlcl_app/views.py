@@ -1,14 +1,37 @@
 # -*- coding: utf-8 -*-
+import os
+import json
+import logging
+import mimetypes
+
+import pendulum
+from django.conf import settings
 from django.shortcuts import render, redirect, reverse
 from django.contrib import messages
-from django.http import Http404
-from django.db.models import Max
-
-from tmdnlcl_app.models import AppSetting, TwitterUser, Tweet
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, FileResponse, \
+    JsonResponse
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_safe, require_http_methods
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from tmdnlcl_app.models import AppSetting, TwitterUser, Tweet, Attachment, media_storage
+from tmdnlcl_app.ratelimit import RateLimited
+from tmdnlcl_app.storage import BLOB_PATTERN
 from tmdnlcl_app.forms import TweetPostForm, TwitterUserModeForm
+from tmdnlcl_app.stats import get_stats
+from tmdnlcl_app import webhooks
 
 from twython import Twython, TwythonError
 
+TWEETS_PER_PAGE = 10
+MEDIA_MAX_AGE = 60 * 60 * 24 * 365
+
+logger = logging.getLogger(__name__)
+
 
 def get_user(request, raise_if_not_found=False):
     user_id = request.session.get('user_id', None)
@@ -38,19 +61,23 @@ def index(request):
         if mode_form.is_valid():
             user.mode = mode_form.cleaned_data['mode']
             user.save(update_fields=['mode'])
+            user.update_converted_tweets()
             messages.success(request, "동작 방식이 변경되었습니다.")
 
     mode_form = TwitterUserModeForm(instance=user)
 
     if user is not None:
-        tweets = user.tweet_set.all().order_by('-submitted_at')
+        tweets = user.tweet_set.select_related('user').prefetch_related('attachment_set').order_by('-submitted_at')
+        tweets = Paginator(tweets, TWEETS_PER_PAGE).get_page(request.GET.get('page'))
+
+    stats = get_stats()
 
     return render(request, 'tmdnlcl_app/index.html', {
         'tweets': tweets,
         'user': user,
         'mode_form': mode_form,
-        'total_users': TwitterUser.objects.count(),
-        'last_update': TwitterUser.objects.aggregate(last_update=Max('last_update'))['last_update']
+        'total_users': stats['total_users'],
+        'last_update': stats['last_update'],
     })
 
 
@@ -79,7 +106,14 @@ def post(request):
             raise Http404
 
         tweet.content = form.cleaned_data['content']
-        tweet.post()
+
+        try:
+            tweet.post()
+        except RateLimited as e:
+            reset_at = timezone.localtime(e.reset_at)
+            messages.error(request, f"트위터 호출 한도를 다 썼습니다. {reset_at:%H:%M} 이후에 다시 해보세요.")
+            return redirect(reverse('index'))
+
         tweet.delete()
 
         messages.success(request, "트윗을 전송하였습니다.")
@@ -111,22 +145,130 @@ def login(request):
                           request.session['oauth_token'], request.session['oauth_token_secret'])
         token = twitter.get_authorized_tokens(oauth_verifier)
 
-        user, created = TwitterUser.objects.get_or_create(
+        user, _ = TwitterUser.objects.get_or_create(
             id=token['user_id'],
             defaults={'oauth_token': token['oauth_token'], 'oauth_token_secret': token['oauth_token_secret']}
         )
 
         try:
-            request.session['screen_name'] = user.get_user_info()['screen_name']
+            request.session['screen_name'] = user.get_screen_name(refresh=True)
             request.session['user_id'] = user.id
         except TwythonError:
             if user is not None:
                 user.delete()
                 messages.warning(request, "뭔가 심상치 않은 일이 생겼습니다. 다시 연동해보세요.")
 
+            return redirect('index')
+
+        try:
+            user.subscribe_webhook()
+        except TwythonError:
+            # 구독이 안 되어도 검색으로 다시 찾으므로 로그인은 그대로 진행한다.
+            logger.exception("%s 웹훅 구독 실패", user.id)
+
         return redirect('index')
 
 
 def logout(request):
     request.session.flush()
     return redirect('index')
+
+
+def media_etag(request, name):
+    # 내용 해시로 이름을 지은 파일은 이름이 곧 ETag다.
+    if BLOB_PATTERN.match(name):
+        return os.path.splitext(os.path.basename(name))[0]
+
+    return None
+
+
+def media_last_modified(request, name):
+    if BLOB_PATTERN.match(name):
+        return None
+
+    try:
+        return pendulum.from_timestamp(os.path.getmtime(media_storage.path(name)))
+    except OSError:
+        return None
+
+
+@require_safe
+def media(request, name):
+    user_id = request.session.get('user_id', None)
+
+    if user_id is None:
+        raise Http404
+
+    if not Attachment.objects.filter(Q(file=name) | Q(thumbnail=name), tweet__user_id=user_id).exists():
+        raise Http404
+
+    # 권한을 확인한 뒤에 조건부 요청을 처리해야 남의 파일이 있는지를 304로 알려주지 않는다.
+    etag = media_etag(request, name)
+    last_modified = media_last_modified(request, name)
+
+    if etag is not None:
+        etag = quote_etag(etag)
+
+    if last_modified is not None:
+        last_modified = int(last_modified.timestamp())
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+    if response is None:
+        path = media_storage.path(name)
+
+        if settings.MEDIA_ACCEL == 'nginx':
+            response = HttpResponse()
+            response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX + name
+        elif settings.MEDIA_ACCEL == 'sendfile':
+            response = HttpResponse()
+            response['X-Sendfile'] = path
+        else:
+            try:
+                response = FileResponse(open(path, 'rb'))
+            except FileNotFoundError:
+                raise Http404
+
+        # 전송은 프론트 서버가 맡으므로 Content-Type은 여기서 정해서 넘긴다.
+        response['Content-Type'] = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+    if etag is not None:
+        response['ETag'] = etag
+
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+
+    if BLOB_PATTERN.match(name):
+        response['Cache-Control'] = f"private, max-age={MEDIA_MAX_AGE}, immutable"
+    else:
+        response['Cache-Control'] = "private, no-cache"
+
+    return response
+
+
+@csrf_exempt
+@require_http_methods(['GET', 'POST'])
+def webhook(request):
+    secret = AppSetting.get_solo().twitter_api_secret
+
+    if not secret:
+        raise Http404
+
+    # 트위터가 주기적으로 보내는 CRC 확인 요청
+    if request.method == 'GET':
+        crc_token = request.GET.get('crc_token')
+
+        if crc_token is None:
+            return HttpResponseBadRequest()
+
+        return JsonResponse(webhooks.crc_response(secret, crc_token))
+
+    if not webhooks.verify(secret, request.body, request.META.get(webhooks.SIGNATURE_HEADER)):
+        return HttpResponseForbidden()
+
+    try:
+        webhooks.accept(json.loads(request.body))
+    except ValueError:
+        return HttpResponseBadRequest()
+
+    return HttpResponse()
@@ -0,0 +1,80 @@
+import hmac
+import json
+import base64
+import hashlib
+import logging
+
+from tmdnlcl_app import outbox
+from tmdnlcl_app.batch import SEARCH_KEYWORD
+from tmdnlcl_app.models import OutboxOperation, TwitterUser
+
+SIGNATURE_HEADER = 'HTTP_X_TWITTER_WEBHOOKS_SIGNATURE'
+
+logger = logging.getLogger(__name__)
+
+
+def sign(secret, message):
+    digest = hmac.new(secret.encode(), message, hashlib.sha256).digest()
+    return "sha256=" + base64.b64encode(digest).decode()
+
+
+def crc_response(secret, crc_token):
+    return {'response_token': sign(secret, crc_token.encode())}
+
+
+def verify(secret, body, signature):
+    return signature is not None and hmac.compare_digest(sign(secret, body), signature)
+
+
+def normalize(status):
+    # 웹훅은 긴 트윗을 잘라서 보내고 전체 내용과 미디어는 extended_tweet에 넣는다. 검색 결과와 같은 모양으로 맞춘다.
+    extended = status.get('extended_tweet')
+
+    if extended is None:
+        return status
+
+    status = dict(status)
+    status['text'] = extended.get('full_text', status['text'])
+
+    if 'extended_entities' in extended:
+        status['extended_entities'] = extended['extended_entities']
+
+    return status
+
+
+def matching_statuses(user, event):
+    for status in event.get('tweet_create_events', []):
+        # 구독한 사용자가 다른 사람의 트윗을 리트윗하거나 멘션받은 것도 들어오므로 본인 트윗만 고른다.
+        if status.get('user', {}).get('id') != user.id or 'retweeted_status' in status:
+            continue
+
+        status = normalize(status)
+
+        if SEARCH_KEYWORD.lower() in status['text'].lower() and user.check_text_pattern(status['text']):
+            yield status
+
+
+def accept(event):
+    # 받은 트윗은 아웃박스에 넣기만 하고 바로 응답한다. 미디어를 받고 저장하는 것은 배치의 Push 단계가 맡는다.
+    # 서명은 맞지만 모양이 이상한 이벤트는 ValueError를 내서 400으로 돌려보낸다.
+    if not isinstance(event, dict) or not isinstance(event.get('for_user_id'), (str, int)):
+        raise ValueError("잘못된 웹훅 이벤트")
+
+    try:
+        user = TwitterUser.objects.get(id=int(event['for_user_id']))
+    except TwitterUser.DoesNotExist:
+        return 0
+
+    try:
+        statuses = list(matching_statuses(user, event))
+    except (TypeError, KeyError, AttributeError) as e:
+        raise ValueError("잘못된 웹훅 이벤트") from e
+
+    if statuses:
+        outbox.enqueue_many([(OutboxOperation.INGEST, user, status['id'], False) for status in statuses],
+                            {status['id']: json.dumps(status) for status in statuses})
+
+        for status in statuses:
+            logger.info("%s-%s 웹훅으로 트윗 받음", user.id, status['id'])
+
+    return len(statuses)